@@ -0,0 +1,191 @@
+#!/bin/env python
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import yaml
+from mpm import resolver, snapshot
+from mpm.main import Config
+from mpm.model import *
+from mpm.plan import applyPlan, buildPlan
+from mpm.resolver import resolveNetwork
+from mpm.verify import HashCache, verifyJars
+
+SIZES = {
+    'small': {'repos': 2, 'plugins': 20, 'versions': 5, 'servers': 5},
+    'medium': {'repos': 4, 'plugins': 100, 'versions': 10, 'servers': 20},
+    'large': {'repos': 8, 'plugins': 300, 'versions': 20, 'servers': 50},
+}
+
+def makeJar(path, name, version):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('plugin.yml', 'name: {}\nversion: {}\nmain: bench.Main\n'.format(name, version))
+        archive.writestr('bench/Main.class', '{}-{}'.format(name, version) * 64)
+    with open(path, 'wb') as fd:
+        fd.write(buf.getvalue())
+
+def generateNetwork(root, repos, plugins, versions, servers):
+    config = {'repositories': {}, 'servers': {}}
+    pluginNames = ['Plugin{:04d}'.format(i) for i in range(plugins)]
+
+    for r in range(repos):
+        repoPath = os.path.join(root, 'repos', 'repo{}'.format(r))
+        os.makedirs(repoPath)
+        config['repositories']['repo{}'.format(r)] = {'path': repoPath}
+        for (i, name) in enumerate(pluginNames):
+            if i % repos != r:
+                continue
+            for v in range(versions):
+                makeJar(os.path.join(repoPath, '{}-1.{}.0.jar'.format(name, v)), name, '1.{}.0'.format(v))
+
+    for s in range(servers):
+        serverPath = os.path.join(root, 'servers', 'server{}'.format(s))
+        versionsPath = os.path.join(serverPath, 'plugins', 'versions')
+        os.makedirs(versionsPath)
+        declared = []
+        for (i, name) in enumerate(pluginNames):
+            if (i + s) % 3 == 0:
+                continue
+            declared.append({'name': name, 'version': '<1.{}.0'.format(versions - (i + s) % 2)})
+            if (i + s) % 3 == 1:
+                repoPath = os.path.join(root, 'repos', 'repo{}'.format(i % repos))
+                for v in range(min(versions, 2)):
+                    installed = '{}-1.{}.0.jar'.format(name, v)
+                    shutil.copyfile(os.path.join(repoPath, installed), os.path.join(versionsPath, installed))
+                # Link the oldest copy so sync has symlinks to update too.
+                os.symlink(os.path.join('versions', '{}-1.0.0.jar'.format(name)), os.path.join(serverPath, 'plugins', name + '.jar'))
+        config['servers']['server{}'.format(s)] = {'path': serverPath, 'plugins': declared, 'inherit': []}
+
+    importPath = os.path.join(root, 'import')
+    os.makedirs(importPath)
+    for name in pluginNames:
+        makeJar(os.path.join(importPath, '{}-2.0.0.jar'.format(name)), name, '2.0.0')
+
+    configPath = os.path.join(root, 'mpm.yaml')
+    with open(configPath, 'w') as fd:
+        yaml.safe_dump(config, fd)
+    return configPath
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+def consume(iterable):
+    for _ in iterable:
+        pass
+
+def benchRepoList(configPath):
+    for repo in Config(configPath).repositories():
+        sorted(repo.plugins())
+        consume(repo.badFiles())
+
+def benchResolve(configPath):
+    config = Config(configPath)
+    for server in config.servers():
+        consume(server.pluginStates(config.catalog()))
+
+def benchServerList(configPath):
+    config = Config(configPath)
+    consume(resolveNetwork(config.servers(), config.catalog()))
+
+def benchImport(configPath, root):
+    config = Config(configPath)
+    repo = config.repositories()[0]
+    importPath = os.path.join(root, 'import')
+    paths = [os.path.join(importPath, f) for f in sorted(os.listdir(importPath))]
+    cache = HashCache(os.path.join(root, 'hashes.json'))
+    verified = verifyJars(paths, cache)
+    for path in paths:
+        plugin = Plugin(path)
+        repo.importPlugin(plugin, verified[path][0])
+
+def benchSync(configPath, jobs):
+    config = Config(configPath)
+    plan = buildPlan(resolveNetwork(config.servers(), config.catalog()))
+    servers = {name: config.server(name) for name in plan}
+    consume(applyPlan(plan, servers, jobs))
+
+def runSize(name, params, repeat, jobs):
+    timings = {}
+
+    def record(key, fn, warm=False):
+        if not warm:
+            # Start from an empty in-process cache so each phase pays for its
+            # own scans instead of reusing the previous phase's.
+            snapshot.invalidate()
+            resolver.versionsCache.clear()
+        timings[key] = min(timings.get(key, float('inf')), timed(fn))
+
+    for i in range(repeat):
+        root = tempfile.mkdtemp(prefix='mpm-bench-')
+        try:
+            configPath = generateNetwork(root, **params)
+            record('repo_list_cold', lambda: benchRepoList(configPath))
+            record('repo_list_warm', lambda: benchRepoList(configPath), warm=True)
+            record('resolve', lambda: benchResolve(configPath))
+            record('server_list', lambda: benchServerList(configPath))
+            record('sync', lambda: benchSync(configPath, jobs))
+            record('server_list_synced', lambda: benchServerList(configPath))
+            record('import', lambda: benchImport(configPath, root))
+        finally:
+            shutil.rmtree(root)
+
+    return {'size': name, 'params': params, 'timings': timings}
+
+def gitRevision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(previous, current):
+    baseline = {r['size']: r['timings'] for r in previous['results']}
+    for result in current['results']:
+        if result['size'] not in baseline:
+            continue
+        print(result['size'], file=sys.stderr)
+        for (key, seconds) in sorted(result['timings'].items()):
+            before = baseline[result['size']].get(key)
+            if before:
+                print("\t{:<20} {:>9.4f}s {:>9.4f}s {:>+7.1%}".format(key, before, seconds, seconds / before - 1), file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark mpm against synthetic networks')
+    parser.add_argument('--size', action='append', choices=sorted(SIZES), help='Network sizes to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per size; the fastest is reported')
+    parser.add_argument('--jobs', type=int, default=4, help='Parallel servers during sync')
+    parser.add_argument('--output', help='Write results as JSON to this file instead of stdout')
+    parser.add_argument('--compare', help='Previous results file to compare against')
+    args = parser.parse_args()
+
+    results = {
+        'revision': gitRevision(),
+        'python': platform.python_version(),
+        'results': [runSize(size, SIZES[size], args.repeat, args.jobs) for size in (args.size or sorted(SIZES, key=lambda s: SIZES[s]['plugins']))],
+    }
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as fd:
+            json.dump(results, fd, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare, 'r') as fd:
+            compare(json.load(fd), results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+# Runs on the far side of a CommandTransport. It is sent over stdin and
+# exec'd by a bare python3, so it must only use the standard library and
+# must not import anything from mpm.
+import hashlib
+import json
+import os
+import shutil
+import stat
+import sys
+
+CHUNK_SIZE = 1024 * 1024
+READ_ONLY = 0o444
+
+def describe(path, name):
+    st = os.lstat(path)
+    target = None
+    if stat.S_ISLNK(st.st_mode):
+        kind = 'link'
+        target = os.readlink(path)
+    elif stat.S_ISDIR(st.st_mode):
+        kind = 'dir'
+    elif stat.S_ISREG(st.st_mode):
+        kind = 'file'
+    else:
+        kind = 'other'
+    return [name, kind, st.st_size, st.st_mtime_ns, target]
+
+def listDir(path):
+    try:
+        names = os.listdir(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    entries = []
+    for name in names:
+        try:
+            entries.append(describe(os.path.join(path, name), name))
+        except FileNotFoundError:
+            pass
+    return entries
+
+def listing(root):
+    pluginPath = os.path.join(root, 'plugins')
+    generationsPath = os.path.join(pluginPath, '.generations')
+    paths = [pluginPath, os.path.join(pluginPath, 'versions'), generationsPath]
+    for entry in listDir(generationsPath) or ():
+        if entry[1] == 'dir':
+            paths.append(os.path.join(generationsPath, entry[0]))
+    dirs = {}
+    mtimes = {}
+    for path in paths:
+        entries = listDir(path)
+        if entries is not None:
+            dirs[path] = entries
+            mtimes[path] = os.stat(path).st_mtime_ns
+    return {'dirs': dirs, 'mtimes': mtimes}
+
+def hashFile(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def have(root, wanted):
+    versionsPath = os.path.join(root, 'plugins', 'versions')
+    sizes = {size for (digest, size) in wanted}
+    digests = {digest for (digest, size) in wanted}
+    found = {}
+    for entry in listDir(versionsPath) or ():
+        if entry[1] != 'file' or entry[2] not in sizes:
+            continue
+        path = os.path.join(versionsPath, entry[0])
+        digest = hashFile(path)
+        if digest in digests:
+            found[digest] = path
+    return found
+
+def replaceWith(path, create):
+    tmp = path + '.mpm-tmp'
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    create(tmp)
+    if not os.path.islink(tmp):
+        os.chmod(tmp, READ_ONLY)
+    os.replace(tmp, path)
+
+def receive(stream, size, sha256, tmp):
+    digest = hashlib.sha256()
+    with open(tmp, 'wb') as fd:
+        while size > 0:
+            chunk = stream.read(min(size, CHUNK_SIZE))
+            if len(chunk) == 0:
+                raise EOFError("Transfer ended early")
+            digest.update(chunk)
+            fd.write(chunk)
+            size -= len(chunk)
+    if digest.hexdigest() != sha256:
+        raise ValueError("Received {} does not match its hash".format(tmp))
+
+def copy(src, dest):
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copyfile(src, dest)
+
+def apply(ops, stream):
+    for op in ops:
+        kind = op[0]
+        if kind == 'makedirs':
+            os.makedirs(op[1])
+        elif kind == 'symlink':
+            (target, path, replace) = op[1:]
+            if replace:
+                replaceWith(path, lambda tmp: os.symlink(target, tmp))
+            else:
+                os.symlink(target, path)
+        elif kind == 'put':
+            (path, size, sha256) = op[1:]
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            replaceWith(path, lambda tmp: receive(stream, size, sha256, tmp))
+        elif kind == 'copy':
+            (src, path) = op[1:]
+            replaceWith(path, lambda tmp: copy(src, tmp))
+        elif kind == 'rmtree':
+            shutil.rmtree(op[1])
+        elif kind == 'unlink':
+            os.unlink(op[1])
+        else:
+            raise ValueError("Unknown operation {}".format(kind))
+    return len(ops)
+
+def main():
+    stream = sys.stdin.buffer
+    request = json.loads(stream.readline())
+    try:
+        if request['op'] == 'list':
+            response = {'result': listing(request['root'])}
+        elif request['op'] == 'have':
+            response = {'result': have(request['root'], request['wanted'])}
+        elif request['op'] == 'apply':
+            response = {'result': apply(request['ops'], stream)}
+        else:
+            response = {'error': "Unknown request {}".format(request['op'])}
+    except (OSError, ValueError, EOFError) as e:
+        response = {'error': "{}: {}".format(type(e).__name__, e)}
+    sys.stdout.write(json.dumps(response))
+    sys.stdout.flush()
+
+if __name__ == '__main__':
+    main()
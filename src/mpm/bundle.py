@@ -0,0 +1,109 @@
+import hashlib
+import io
+import json
+import os
+import tarfile
+from mpm import snapshot
+from mpm.lock import cachedHash
+from mpm.throttle import CHUNK_SIZE
+
+MANIFEST_NAME = 'manifest.json'
+BUNDLE_VERSION = 1
+
+def bundleSources(resolution):
+    server = resolution.server
+    sources = {}
+    for state in resolution.installed:
+        sources[state.plugin.name] = (state.currentVersion, server.resolveLink(state.plugin.name))
+    for state in resolution.outdated:
+        path = os.path.join(server.pluginPath, 'versions', '{}-{}.jar'.format(state.plugin.name, state.wantedVersion))
+        sources[state.plugin.name] = (state.wantedVersion, path)
+    for state in resolution.available:
+        sources[state.plugin.name] = (state.plugin.version, state.plugin.path)
+    for state in resolution.missing:
+        raise ValueError("Cannot bundle {}: no version of {} satisfies {}".format(server.name, state.plugin.name, state.plugin.versionSpec))
+    for state in resolution.conflicts:
+        raise ValueError("Cannot bundle {}: plugins/{}.jar is a regular file, not a managed link".format(server.name, state.plugin.name))
+    return sources
+
+def writeBundle(resolution, fileobj, hashCache):
+    sources = bundleSources(resolution)
+    plugins = {}
+    for (name, (version, path)) in sorted(sources.items()):
+        plugins[name] = {
+            'version': str(version),
+            'file': 'versions/{}-{}.jar'.format(name, version),
+            'size': os.path.getsize(path),
+            'sha256': cachedHash(path, hashCache),
+        }
+    manifest = json.dumps({'version': BUNDLE_VERSION, 'server': resolution.server.name, 'plugins': plugins}, indent=2, sort_keys=True).encode()
+
+    # Stream mode writes members back to back without seeking, so the bundle
+    # can go straight to a pipe. The manifest goes first, so a jar whose hash
+    # is not cached yet is read twice: once to hash it, once to stream it.
+    with tarfile.open(fileobj=fileobj, mode='w|') as archive:
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(manifest)
+        archive.addfile(info, io.BytesIO(manifest))
+        for (name, entry) in sorted(plugins.items()):
+            info = tarfile.TarInfo(entry['file'])
+            info.size = entry['size']
+            info.mode = 0o644
+            with open(sources[name][1], 'rb') as fd:
+                archive.addfile(info, fd)
+    return plugins
+
+def readManifest(archive):
+    member = archive.next()
+    if member is None or member.name != MANIFEST_NAME:
+        raise ValueError("Bundle does not start with {}".format(MANIFEST_NAME))
+    manifest = json.load(archive.extractfile(member))
+    if manifest.get('version') != BUNDLE_VERSION:
+        raise ValueError("Unsupported bundle version {}".format(manifest.get('version')))
+    return manifest
+
+def unpackMember(archive, member, dest, sha256):
+    digest = hashlib.sha256()
+    tmp = dest + '.mpm-tmp'
+    source = archive.extractfile(member)
+    with open(tmp, 'wb') as fd:
+        for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+            fd.write(chunk)
+    if digest.hexdigest() != sha256:
+        os.unlink(tmp)
+        raise ValueError("{} does not match its manifest hash".format(member.name))
+    os.replace(tmp, dest)
+
+def openBundle(fileobj):
+    archive = tarfile.open(fileobj=fileobj, mode='r|')
+    return (archive, readManifest(archive))
+
+def checkManifestEntry(name, entry):
+    if name in ('', '.', '..') or '/' in name or os.sep in name or '..' in name:
+        raise ValueError("Invalid plugin name in bundle: {!r}".format(name))
+    version = str(entry['version'])
+    if '/' in version or os.sep in version or '..' in version:
+        raise ValueError("Invalid version of {} in bundle: {!r}".format(name, version))
+    if entry['file'] != 'versions/{}-{}.jar'.format(name, version):
+        raise ValueError("Invalid file for {} in bundle: {!r}".format(name, entry['file']))
+
+def unpackBundle(archive, manifest, server):
+    for (name, entry) in manifest['plugins'].items():
+        checkManifestEntry(name, entry)
+    versionsPath = os.path.join(server.pluginPath, 'versions')
+    os.makedirs(versionsPath, exist_ok=True)
+    expected = {entry['file']: (name, entry) for (name, entry) in manifest['plugins'].items()}
+    versions = {}
+    # Iterating the TarFile would start over with the manifest; next() keeps
+    # reading forward through the stream.
+    for member in iter(archive.next, None):
+        if member.name not in expected or not member.isfile():
+            raise ValueError("Unexpected bundle member {}".format(member.name))
+        (name, entry) = expected.pop(member.name)
+        unpackMember(archive, member, os.path.join(server.pluginPath, entry['file']), entry['sha256'])
+        versions[name] = entry['version']
+    snapshot.invalidate(versionsPath)
+    if len(expected) > 0:
+        raise ValueError("Bundle is missing {}".format(', '.join(sorted(expected))))
+    return (versions, server.applyVersions(versions))
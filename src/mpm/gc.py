@@ -0,0 +1,119 @@
+import os
+import shutil
+from mpm import snapshot
+from mpm.resolver import parseJarVersion
+from mpm.store import BLOB_DIRNAME
+
+class Garbage:
+    def __init__(self, owner, path, size):
+        self.owner = owner
+        self.path = path
+        self.size = size
+
+def splitVersionedJar(filename, names):
+    for name in names:
+        if filename.startswith(name + '-') and filename.endswith('.jar'):
+            version = parseJarVersion(name, filename)
+            if not isinstance(version, str):
+                return (name, version)
+    return (None, None)
+
+def newest(versionsByName, keep):
+    kept = set()
+    for (name, versions) in versionsByName.items():
+        for version in sorted(versions, reverse=True)[:keep]:
+            kept.add((name, str(version)))
+    return kept
+
+def usedVersions(resolution):
+    used = set()
+    for state in resolution.installed + resolution.outdated:
+        if state.currentVersion is not None:
+            used.add((state.plugin.name, str(state.currentVersion)))
+    for state in resolution.outdated:
+        used.add((state.plugin.name, str(state.wantedVersion)))
+    for state in resolution.available:
+        used.add((state.plugin.name, str(state.plugin.version)))
+    return used
+
+def serverGarbage(resolution, keep):
+    server = resolution.server
+    versionsPath = os.path.join(server.pluginPath, 'versions')
+    linked = server.referencedJars()
+
+    used = usedVersions(resolution)
+    # Longest names first so "Foo-Bar" wins over "Foo" for Foo-Bar-1.0.0.jar.
+    names = sorted({spec.name for spec in server.plugins()}, key=len, reverse=True)
+    candidates = []
+    versionsByName = {}
+    for entry in snapshot.snapshot(versionsPath):
+        if not entry.isFile(followSymlinks=False) or entry.path in linked:
+            continue
+        (name, version) = splitVersionedJar(entry.name, names)
+        if name is not None:
+            if (name, str(version)) in used:
+                continue
+            versionsByName.setdefault(name, []).append(version)
+        candidates.append((entry, name, version))
+
+    kept = newest(versionsByName, keep)
+    for (entry, name, version) in candidates:
+        if name is None or (name, str(version)) not in kept:
+            yield Garbage(server.name, entry.path, entry.stat().st_size)
+
+def repoGarbage(repo, used, keep):
+    versionsByName = {}
+    candidates = []
+    for plugin in repo.plugins():
+        if (plugin.name, str(plugin.version)) in used:
+            continue
+        versionsByName.setdefault(plugin.name, []).append(plugin.version)
+        candidates.append(plugin)
+
+    kept = newest(versionsByName, keep)
+    for plugin in candidates:
+        if (plugin.name, str(plugin.version)) not in kept:
+            yield Garbage(repo.name, plugin.path, os.path.getsize(plugin.path))
+
+def blobGarbage(repo, removed):
+    # A blob is only referenced by the repo files hardlinked to it, so it is
+    # garbage once its link count drops to one, counting the files that are
+    # about to be removed.
+    removedInodes = {}
+    for path in removed:
+        st = os.stat(path)
+        removedInodes[(st.st_dev, st.st_ino)] = removedInodes.get((st.st_dev, st.st_ino), 0) + 1
+    blobRoot = os.path.join(repo.path, BLOB_DIRNAME)
+    if not os.path.isdir(blobRoot):
+        return
+    for (dirpath, dirnames, filenames) in os.walk(blobRoot):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            st = os.stat(path)
+            if st.st_nlink - removedInodes.get((st.st_dev, st.st_ino), 0) <= 1:
+                yield Garbage(repo.name, path, st.st_size)
+
+def collect(resolutions, repos, keep):
+    garbage = []
+    used = set()
+    for resolution in resolutions:
+        used |= usedVersions(resolution)
+        # Remote servers still count as users of repo jars, but their own
+        # versions/ directories are not collected.
+        if not resolution.server.transport.remote:
+            garbage += serverGarbage(resolution, keep)
+    for repo in repos:
+        repoFiles = list(repoGarbage(repo, used, keep))
+        garbage += repoFiles
+        garbage += blobGarbage(repo, [g.path for g in repoFiles])
+    return garbage
+
+def dispose(garbage, archive=None):
+    for item in garbage:
+        if archive is None:
+            os.unlink(item.path)
+        else:
+            dest = os.path.join(archive, item.owner, os.path.basename(item.path))
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.move(item.path, dest)
+        snapshot.invalidate(os.path.dirname(item.path))
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import sys
+from mpm import snapshot
+
+INDEX_FILENAME = '.mpm-index.json'
+INDEX_VERSION = 1
+
+class RepoIndex:
+    def __init__(self, path):
+        self.path = path
+        self.indexPath = os.path.join(path, INDEX_FILENAME)
+        self.mtime = None
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.indexPath, 'r') as fd:
+                data = json.load(fd)
+        except (OSError, ValueError):
+            return
+        if not isinstance(data, dict) or data.get('version') != INDEX_VERSION:
+            return
+        self.mtime = data['mtime']
+        self.entries = data['entries']
+        for entry in self.entries.values():
+            if entry[0] is not None:
+                entry[0] = sys.intern(entry[0])
+
+    def save(self):
+        created = not os.path.exists(self.indexPath)
+        self.write()
+        if created:
+            # Creating the index bumps the directory mtime; rewriting it in
+            # place afterwards does not, so record the new mtime once.
+            self.mtime = os.stat(self.path).st_mtime_ns
+            self.write()
+
+    def write(self):
+        data = {
+            'version': INDEX_VERSION,
+            'mtime': self.mtime,
+            'entries': self.entries,
+        }
+        with open(self.indexPath, 'w') as fd:
+            json.dump(data, fd)
+
+    def fingerprint(self):
+        # Taken from the entries themselves, so an index that was deleted and
+        # rebuilt never matches a fingerprint recorded before it changed.
+        digest = hashlib.sha256()
+        for (filename, (name, version, size, mtime)) in sorted(self.entries.items()):
+            digest.update('{}\0{}\0{}\n'.format(filename, size, mtime).encode())
+        return digest.hexdigest()
+
+    def plugins(self):
+        for (filename, (name, version, size, mtime)) in self.entries.items():
+            if name is not None:
+                yield (filename, name, version, size, mtime)
+
+    def badFiles(self):
+        for (filename, (name, version, size, mtime)) in self.entries.items():
+            if name is None:
+                yield filename
+
+    def parseEntry(self, path, st, parse):
+        try:
+            (name, version) = parse(path)
+        except ValueError:
+            (name, version) = (None, None)
+        return [name, version, st.st_size, st.st_mtime_ns]
+
+    def refreshEntries(self, parse):
+        # An unchanged directory mtime only means no file was added, removed
+        # or renamed; jars overwritten in place still need their own stat.
+        changed = False
+        for (filename, cached) in list(self.entries.items()):
+            path = os.path.join(self.path, filename)
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+            if cached[2] != st.st_size or cached[3] != st.st_mtime_ns:
+                self.entries[filename] = self.parseEntry(path, st, parse)
+                changed = True
+        return changed
+
+    def refresh(self, parse):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self.mtime:
+            changed = self.refreshEntries(parse)
+            if changed is False:
+                return False
+            if changed:
+                try:
+                    self.save()
+                except OSError:
+                    pass
+                return True
+
+        entries = {}
+        snapshot.invalidate(self.path)
+        for entry in snapshot.snapshot(self.path):
+            if entry.name.startswith('.') or not entry.isFile():
+                continue
+            st = entry.stat(followSymlinks=True)
+            cached = self.entries.get(entry.name)
+            if cached is not None and cached[2] == st.st_size and cached[3] == st.st_mtime_ns:
+                entries[entry.name] = cached
+                continue
+            entries[entry.name] = self.parseEntry(entry.path, st, parse)
+
+        self.entries = entries
+        self.mtime = mtime
+        try:
+            self.save()
+        except OSError:
+            pass
+        return True
@@ -0,0 +1,152 @@
+import contextlib
+import os
+import sys
+import threading
+import time
+
+COUNTED_CALLS = (
+    (os, 'listdir'),
+    (os, 'scandir'),
+    (os, 'stat'),
+    (os, 'lstat'),
+    (os, 'readlink'),
+    (os, 'symlink'),
+    (os, 'link'),
+    (os, 'unlink'),
+    (os, 'replace'),
+)
+
+active = None
+
+class Profiler:
+    def __init__(self, cprofile=False):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.elapsed = None
+        self.phases = {}
+        self.servers = {}
+        self.calls = {}
+        self.bytesCopied = 0
+        self.patched = []
+        self.cprofile = None
+        if cprofile:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+
+    def record(self, table, name, seconds):
+        with self.lock:
+            entry = table.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+    @contextlib.contextmanager
+    def timer(self, table, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(table, name, time.perf_counter() - start)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + amount
+
+    def copied(self, amount):
+        with self.lock:
+            self.calls['copyfile'] = self.calls.get('copyfile', 0) + 1
+            self.bytesCopied += amount
+
+    def patch(self, owner, attr, replacement):
+        self.patched.append((owner, attr, getattr(owner, attr)))
+        setattr(owner, attr, replacement)
+
+    def countCalls(self, owner, attr):
+        original = getattr(owner, attr)
+        def counted(*args, **kwargs):
+            self.count(attr)
+            return original(*args, **kwargs)
+        self.patch(owner, attr, counted)
+
+    def start(self):
+        for (owner, attr) in COUNTED_CALLS:
+            self.countCalls(owner, attr)
+
+        import shutil
+        copyfile = shutil.copyfile
+        def countedCopyfile(src, dst, *args, **kwargs):
+            result = copyfile(src, dst, *args, **kwargs)
+            self.copied(os.path.getsize(dst))
+            return result
+        self.patch(shutil, 'copyfile', countedCopyfile)
+
+        from semantic_version import Version
+        coerce = Version.coerce.__func__
+        def timedCoerce(cls, version_string, partial=False):
+            with self.timer(self.phases, 'version-parse'):
+                return coerce(cls, version_string, partial)
+        self.patch(Version, 'coerce', classmethod(timedCoerce))
+
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def stop(self):
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        for (owner, attr, original) in reversed(self.patched):
+            setattr(owner, attr, original)
+        self.patched = []
+        self.elapsed = time.perf_counter() - self.started
+
+    def report(self):
+        return {
+            'elapsed': self.elapsed,
+            'phases': {name: {'count': c, 'seconds': s} for (name, (c, s)) in self.phases.items()},
+            'servers': {name: {'count': c, 'seconds': s} for (name, (c, s)) in self.servers.items()},
+            'calls': dict(self.calls),
+            'bytesCopied': self.bytesCopied,
+        }
+
+    def printSummary(self, stream=sys.stderr):
+        print("Profile: {:.3f}s total".format(self.elapsed), file=stream)
+        print("Phases:", file=stream)
+        for (name, (c, s)) in sorted(self.phases.items(), key=lambda item: -item[1][1]):
+            print("\t{:<24} {:>9.4f}s {:>7}x".format(name, s, c), file=stream)
+        print("Servers:", file=stream)
+        for (name, (c, s)) in sorted(self.servers.items(), key=lambda item: -item[1][1]):
+            print("\t{:<24} {:>9.4f}s".format(name, s), file=stream)
+        print("Filesystem calls:", file=stream)
+        for (name, c) in sorted(self.calls.items()):
+            print("\t{:<24} {:>9}".format(name, c), file=stream)
+        print("Bytes copied: {}".format(self.bytesCopied), file=stream)
+
+    def writeJson(self, path):
+        import json
+        with open(path, 'w') as fd:
+            json.dump(self.report(), fd, indent=2)
+
+    def dumpCProfile(self, path):
+        self.cprofile.dump_stats(path)
+
+def enable(cprofile=False):
+    global active
+    active = Profiler(cprofile)
+    active.start()
+    return active
+
+def disable():
+    global active
+    profiler = active
+    active = None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
+
+def phase(name):
+    if active is None:
+        return contextlib.nullcontext()
+    return active.timer(active.phases, name)
+
+def server(name):
+    if active is None:
+        return contextlib.nullcontext()
+    return active.timer(active.servers, name)
@@ -0,0 +1,107 @@
+import os
+import re
+import struct
+import zlib
+
+EOCD_SIGNATURE = b'PK\x05\x06'
+EOCD_FORMAT = '<4s4H2LH'
+CENTRAL_SIGNATURE = b'PK\x01\x02'
+CENTRAL_FORMAT = '<4s6H3L5H2L'
+LOCAL_SIGNATURE = b'PK\x03\x04'
+LOCAL_FORMAT = '<4s5H3L2H'
+MAX_COMMENT = 0xffff
+
+METADATA_FILES = ('plugin.yml', 'paper-plugin.yml')
+metadata_key_pattern = re.compile(r'^(name|version)\s*:\s*(.*?)\s*$')
+leading_version_pattern = re.compile(r'\d+(?:\.\d+)*')
+
+metadataCache = {}
+
+def findCentralDirectory(fd, size):
+    tailSize = min(size, struct.calcsize(EOCD_FORMAT) + MAX_COMMENT)
+    fd.seek(size - tailSize)
+    tail = fd.read(tailSize)
+    recordSize = struct.calcsize(EOCD_FORMAT)
+    eocd = tail.rfind(EOCD_SIGNATURE)
+    # The archive comment may itself contain the signature; the real record
+    # is the one whose comment runs exactly to the end of the file.
+    while eocd != -1:
+        fields = struct.unpack_from(EOCD_FORMAT, tail, eocd) if eocd + recordSize <= len(tail) else None
+        if fields is not None and eocd + recordSize + fields[7] == len(tail):
+            break
+        eocd = tail.rfind(EOCD_SIGNATURE, 0, eocd)
+    if eocd == -1:
+        raise ValueError("No zip end of central directory record")
+    (entries, cdSize, cdOffset) = (fields[4], fields[5], fields[6])
+    if entries == 0xffff or cdOffset == 0xffffffff:
+        raise ValueError("Zip64 archives are not supported")
+    return (entries, cdSize, cdOffset)
+
+def readMember(fd, names):
+    (entries, cdSize, cdOffset) = findCentralDirectory(fd, os.fstat(fd.fileno()).st_size)
+    fd.seek(cdOffset)
+    directory = fd.read(cdSize)
+    headerSize = struct.calcsize(CENTRAL_FORMAT)
+    offset = 0
+    found = {}
+    for i in range(entries):
+        fields = struct.unpack_from(CENTRAL_FORMAT, directory, offset)
+        if fields[0] != CENTRAL_SIGNATURE:
+            raise ValueError("Corrupt zip central directory")
+        (method, compressedSize, nameLen, extraLen, commentLen, localOffset) = (fields[4], fields[8], fields[10], fields[11], fields[12], fields[16])
+        name = directory[offset + headerSize:offset + headerSize + nameLen].decode('utf-8', 'replace')
+        if name in names:
+            found[name] = (method, compressedSize, localOffset)
+        offset += headerSize + nameLen + extraLen + commentLen
+
+    for name in names:
+        if name not in found:
+            continue
+        (method, compressedSize, localOffset) = found[name]
+        fd.seek(localOffset)
+        header = struct.unpack(LOCAL_FORMAT, fd.read(struct.calcsize(LOCAL_FORMAT)))
+        if header[0] != LOCAL_SIGNATURE:
+            raise ValueError("Corrupt zip local header")
+        fd.seek(header[9] + header[10], os.SEEK_CUR)
+        data = fd.read(compressedSize)
+        if method == 0:
+            return data
+        if method == 8:
+            return zlib.decompressobj(-zlib.MAX_WBITS).decompress(data)
+        raise ValueError("Unsupported zip compression method {}".format(method))
+    return None
+
+def parseMetadata(text):
+    metadata = {}
+    for line in text.splitlines():
+        match = metadata_key_pattern.match(line)
+        if match is None or match[1] in metadata:
+            continue
+        value = match[2]
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in '"\'':
+            value = value[1:-1]
+        metadata[match[1]] = value
+    return metadata
+
+def readPluginMetadata(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+    if key not in metadataCache:
+        try:
+            with open(path, 'rb') as fd:
+                data = readMember(fd, METADATA_FILES)
+        except (OSError, ValueError, zlib.error, struct.error):
+            data = None
+        metadata = None
+        if data is not None:
+            metadata = parseMetadata(data.decode('utf-8', 'replace'))
+            version = leading_version_pattern.search(metadata.get('version', ''))
+            if 'name' in metadata and version is not None:
+                metadata['version'] = version[0]
+            else:
+                metadata = None
+        metadataCache[key] = metadata
+    return metadataCache[key]
@@ -0,0 +1,91 @@
+import json
+import os
+from mpm.query import catalogFingerprint, serverFingerprint
+from mpm.resolver import parseJarVersion
+from mpm.store import hashFile
+
+LOCK_FILENAME = 'mpm-lock.json'
+LOCK_VERSION = 1
+
+def cachedHash(path, hashCache):
+    cached = hashCache.get(path)
+    if cached is None:
+        cached = (hashFile(path), None)
+        hashCache.put(path, *cached)
+    return cached[0]
+
+def inputFingerprint(server, catalogPrint):
+    return {'server': serverFingerprint(server), 'catalog': catalogPrint}
+
+class Lockfile:
+    def __init__(self, server):
+        self.server = server
+        self.path = os.path.join(server.path, LOCK_FILENAME)
+        self.fingerprint = None
+        self.plugins = None
+        try:
+            with open(self.path, 'r') as fd:
+                data = json.load(fd)
+            if data.get('version') == LOCK_VERSION:
+                self.fingerprint = data['fingerprint']
+                self.plugins = data['plugins']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def record(self, fingerprint, hashCache):
+        plugins = {}
+        for spec in self.server.plugins():
+            target = self.server.resolveLink(spec.name)
+            if target is None or not os.path.isfile(target):
+                continue
+            plugins[spec.name] = {
+                'version': str(parseJarVersion(spec.name, os.path.basename(target))),
+                'sha256': cachedHash(target, hashCache),
+            }
+        self.fingerprint = fingerprint
+        self.plugins = plugins
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fd:
+            json.dump({'version': LOCK_VERSION, 'fingerprint': self.fingerprint, 'plugins': self.plugins}, fd, indent=2, sort_keys=True)
+            fd.write('\n')
+        os.replace(tmp, self.path)
+
+    def changes(self, catalog, hashCache):
+        installs = []
+        versions = {}
+        linked = self.server.linkedJars()
+        for (name, entry) in sorted(self.plugins.items()):
+            filename = '{}-{}.jar'.format(name, entry['version'])
+            local = os.path.join(self.server.pluginPath, 'versions', filename)
+            if not os.path.isfile(local) or cachedHash(local, hashCache) != entry['sha256']:
+                candidates = [plugin for plugin in catalog.load().get(name, ()) if plugin.rawVersion == entry['version']]
+                matching = [plugin for plugin in candidates if cachedHash(plugin.path, hashCache) == entry['sha256']]
+                if len(matching) == 0:
+                    raise ValueError("No jar of {} {} matches the locked hash {}".format(name, entry['version'], entry['sha256']))
+                installs.append(matching[0])
+            if linked.get(name) != local:
+                versions[name] = entry['version']
+        return (installs, versions)
+
+def splitUnchanged(servers, catalog, force=False):
+    catalogPrint = catalogFingerprint(catalog)
+    changed = []
+    unchanged = []
+    for server in servers:
+        if not force and Lockfile(server).fingerprint == inputFingerprint(server, catalogPrint):
+            unchanged.append(server)
+        else:
+            changed.append(server)
+    return (changed, unchanged, catalogPrint)
+
+def writeLock(server, catalogPrint, hashCache):
+    if server.transport.remote:
+        return
+    lock = Lockfile(server)
+    lock.record(inputFingerprint(server, catalogPrint), hashCache)
+    try:
+        lock.save()
+    except OSError as e:
+        print("{}: cannot write {}: {}".format(server.name, lock.path, e))
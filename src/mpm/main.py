@@ -1,23 +1,35 @@
 #!/bin/env python
 import argparse
-import pathlib
+import marshal
 import sys
-import yaml
 import os
 
-from mpm.repo import Repo
-from mpm.server import Server
-from mpm.model import *
+from mpm import instrument
 
-try:
-        from yaml import CLoader as Loader, CDumper as Dumper
-except ImportError:
-        from yaml import Loader, Dumper
+# Heavier modules (PyYAML, semantic_version, the resolver and the sync
+# machinery) are imported by the commands that need them so that simple
+# invocations start quickly.
 
-DEFAULT_CONFIG = """
-repositories: {}
-servers: {}
-"""
+CONFIG_CACHE_VERSION = 1
+
+def defaultConfig():
+    return {'repositories': {}, 'servers': {}}
+
+def loadYaml(stream):
+    import yaml
+    try:
+        from yaml import CLoader as Loader
+    except ImportError:
+        from yaml import Loader
+    return yaml.load(stream, Loader=Loader)
+
+def dumpYaml(data, stream):
+    import yaml
+    try:
+        from yaml import CDumper as Dumper
+    except ImportError:
+        from yaml import Dumper
+    yaml.dump(data, stream, Dumper=Dumper)
 
 class Config():
 
@@ -25,18 +37,58 @@ class Config():
         if path is None:
             path = os.path.expanduser('~/mpm.yaml')
         self.path = path
-        with open(path, 'r') as fd:
-            self.yaml = yaml.load(fd, Loader=Loader)
-        self.config = yaml.load(DEFAULT_CONFIG, Loader=Loader)
+        self.cachePath = self.sidecarPath('cache')
+        self.repositoryCatalog = None
+        self.serverInheritance = None
+        self.yaml = self.load()
+        self.config = defaultConfig()
         if isinstance(self.yaml, dict):
             self.config.update(self.yaml)
 
+    def sidecarPath(self, suffix):
+        return os.path.join(os.path.dirname(self.path), '.{}.{}'.format(os.path.basename(self.path), suffix))
+
+    def load(self):
+        st = os.stat(self.path)
+        try:
+            with open(self.cachePath, 'rb') as fd:
+                (version, mtime, size, data) = marshal.load(fd)
+            if version == CONFIG_CACHE_VERSION and mtime == st.st_mtime_ns and size == st.st_size:
+                return data
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+        with open(self.path, 'r') as fd:
+            data = loadYaml(fd)
+        self.writeCache(data, st)
+        return data
+
+    def writeCache(self, data, st):
+        try:
+            cached = marshal.dumps((CONFIG_CACHE_VERSION, st.st_mtime_ns, st.st_size, data))
+            tmp = self.cachePath + '.tmp'
+            with open(tmp, 'wb') as fd:
+                fd.write(cached)
+            os.replace(tmp, self.cachePath)
+        except (OSError, ValueError):
+            # Configs containing types marshal can't represent (e.g. YAML
+            # timestamps) are simply parsed every time.
+            pass
+
     def repository(self, name):
+        from mpm.repo import Repo
         return Repo(name, self.config['repositories'][name])
 
     def repositories(self):
+        from mpm.repo import Repo
         return [Repo(name, c) for (name, c) in self.config['repositories'].items()]
 
+    def catalog(self):
+        from mpm.resolver import Catalog
+        if self.repositoryCatalog is None:
+            self.repositoryCatalog = Catalog(self.repositories())
+        return self.repositoryCatalog
+
     def update_repository(self, name, config):
         self.config['repositories'][name] = config
 
@@ -48,29 +100,43 @@ class Config():
             'path': path
         })
 
+    def inheritance(self):
+        from mpm.server import Inheritance
+        if self.serverInheritance is None:
+            self.serverInheritance = Inheritance(self.config['servers'])
+        return self.serverInheritance
+
     def servers(self):
-        return [Server(name, c) for (name, c) in self.config['servers'].items()]
+        from mpm.server import Server
+        # Entries without a path only exist to be inherited from.
+        return [Server(name, c, self.inheritance()) for (name, c) in self.config['servers'].items() if 'path' in c]
 
     def server(self, name):
-        return Server(name, self.config['servers'][name])
+        from mpm.server import Server
+        return Server(name, self.config['servers'][name], self.inheritance())
 
     def update_server(self, server, config):
         self.config['servers'][server] = config
+        self.inheritance().invalidate()
 
-    def add_server(self, name, path):
+    def add_server(self, name, path, transport=None):
         if name in self.config['servers']:
             raise ValueError("Server already exists")
 
-        self.update_server(name, {
+        config = {
             'path': path,
             'plugins': [],
             'inherit': []
-        })
+        }
+        if transport is not None:
+            config['transport'] = transport
+        self.update_server(name, config)
 
     def save(self):
         stream = open(self.path, 'w')
-        yaml.dump(self.config, stream, Dumper=Dumper)
+        dumpYaml(self.config, stream)
         stream.close()
+        self.writeCache(self.config, os.stat(self.path))
 
 def do_repo_add(args, config):
     if not os.path.exists(args.path):
@@ -79,80 +145,167 @@ def do_repo_add(args, config):
     config.save()
     print("Added repository {}".format(args.path))
 
+def do_repo_list_ndjson(args, config):
+    from mpm.output import pluginRecord, writeRecord
+    for repo in config.repositories():
+        for plugin in repo.plugins():
+            writeRecord(dict(repo=repo.name, **pluginRecord(plugin)))
+        for badFile in repo.badFiles():
+            writeRecord({'repo': repo.name, 'badFile': badFile})
+
+def do_repo_list_json(args, config):
+    from mpm.output import pluginRecord, writeDocument
+    repositories = []
+    for repo in config.repositories():
+        repositories.append({
+            'name': repo.name,
+            'path': repo.path,
+            'plugins': [pluginRecord(plugin) for plugin in repo.sortedPlugins()],
+            'badFiles': sorted(repo.badFiles()),
+        })
+    writeDocument({'repositories': repositories})
+
 def do_repo_list(args, config):
+    if args.format == 'ndjson':
+        return do_repo_list_ndjson(args, config)
+    if args.format == 'json':
+        return do_repo_list_json(args, config)
+
     for repo in config.repositories():
         print("{} ({})".format(repo.name, repo.path))
-        for plugin in sorted(repo.plugins()):
-            print('\t', plugin.name, '\t', plugin.version)
+        for plugin in repo.sortedPlugins():
+            print('\t', plugin.name, '\t', plugin.rawVersion)
         for badFile in sorted(repo.badFiles()):
             print('\tWARNING: Unknown file', badFile)
 
 def do_repo_import(args, config):
+    from mpm.model import Plugin
+    from mpm.repo import findJars
+    from mpm.verify import HashCache, verifyJars
     repo = config.repository(args.name)
-    plugins = []
-    for path in args.path:
+    present = repo.presentPlugins()
+    candidates = []
+    for path in findJars(args.path):
         try:
-            plugins.append(Plugin(path))
+            plugin = Plugin(path)
         except:
             print("Bad plugin filename {}".format(path))
+            continue
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            print("Cannot read {}: {}".format(path, e))
+            continue
+        if (plugin.name, str(plugin.version), size) in present:
+            print("Skipping {}: {} {} already in {}".format(path, plugin.name, plugin.version, repo.name))
+            continue
+        candidates.append(plugin)
+
+    hashCache = HashCache()
+    verified = verifyJars([plugin.path for plugin in candidates], hashCache, args.jobs)
+    plugins = []
+    digests = {}
+    seen = set()
+    destinations = {}
+    for plugin in candidates:
+        (digest, error) = verified[plugin.path]
+        filename = '{}-{}.jar'.format(plugin.name, plugin.version)
+        if error is not None:
+            print("Rejecting corrupt plugin {}: {}".format(plugin.path, error))
+        elif digest in seen or repo.containsContent(digest, os.path.getsize(plugin.path), hashCache):
+            print("Skipping {}: already in {}".format(plugin.path, repo.name))
+        elif filename in destinations:
+            # Different jars that would land on the same file would race on
+            # it during the parallel import; keep the first one found.
+            print("Skipping {}: {} {} is also provided by {}".format(plugin.path, plugin.name, plugin.version, destinations[filename]))
+        else:
+            plugins.append(plugin)
+            digests[plugin.path] = digest
+            seen.add(digest)
+            destinations[filename] = plugin.path
+    hashCache.save()
 
     if len(plugins) == 0:
         print("No plugins found.")
+        return
 
     print('Found the following plugins:')
     for plugin in plugins:
         print("\t{} {}".format(plugin.name, plugin.version))
-    print("Import plugins into {}? [y/N]".format(repo.name))
-    answer = input().lower()
-    if answer == "y":
-        for plugin in plugins:
-            repo.importPlugin(plugin)
-        print("Imported!")
-    else:
-        print("Cancelled.")
+    if not args.yes:
+        print("Import plugins into {}? [y/N]".format(repo.name))
+        if input().lower() != "y":
+            print("Cancelled.")
+            return
+
+    failed = 0
+    for (plugin, error) in repo.importPlugins(plugins, digests, args.copy_jobs):
+        if error is not None:
+            print("Failed to import {}: {}".format(plugin.path, error))
+            failed += 1
+    if failed > 0:
+        print("Imported {} of {} plugins.".format(len(plugins) - failed, len(plugins)))
+        sys.exit(1)
+    print("Imported!")
 
 def do_server_add(args, config):
-    config.add_server(args.name, args.path)
+    config.add_server(args.name, args.path, args.transport)
     config.save()
-    print("Added server {} in {}".format(args.name, args.path))
+    if args.transport is None:
+        print("Added server {} in {}".format(args.name, args.path))
+    else:
+        print("Added server {} in {} via {}".format(args.name, args.path, args.transport))
 
-def do_server_list(args, config):
+def do_server_list_ndjson(args, config):
+    from mpm.output import stateRecord, writeRecord
+    catalog = config.catalog()
     for server in config.servers():
+        with instrument.server(server.name):
+            for state in server.pluginStates(catalog):
+                writeRecord(dict(server=server.name, **stateRecord(state)))
+
+def do_server_list_json(args, config):
+    from mpm.output import stateRecord, writeDocument
+    from mpm.resolver import resolveNetwork
+    servers = []
+    for resolution in resolveNetwork(config.servers(), config.catalog()):
+        servers.append({
+            'name': resolution.server.name,
+            'path': resolution.server.path,
+            'states': [stateRecord(state) for state in resolution.states],
+        })
+    writeDocument({'servers': servers})
+
+def do_server_list(args, config):
+    if args.format == 'ndjson':
+        return do_server_list_ndjson(args, config)
+    if args.format == 'json':
+        return do_server_list_json(args, config)
+
+    from mpm.resolver import resolveNetwork
+
+    for resolution in resolveNetwork(config.servers(), config.catalog()):
+        server = resolution.server
         print('{} ({}):'.format(server.name, server.path))
-        outdatedLinks = []
-        missing = []
-        installed = []
-        unmanaged = []
-        conflicts = []
-        for state in sorted(server.pluginStates(config.repositories())):
-            if isinstance(state, OutdatedSymlink):
-                outdatedLinks.append(state)
-            elif isinstance(state, Installed):
-                installed.append(state)
-            elif isinstance(state, MissingVersions):
-                missing.append(state)
-            elif isinstance(state, UnmanagedFile):
-                unmanaged.append(state)
-            elif isinstance(state, SymlinkConflict):
-                conflicts.append(state)
 
         print("Installed plugins:")
-        for state in sorted(installed):
+        for state in resolution.installed:
             print("\t{} {}: {}".format(state.plugin.name, state.plugin.versionSpec, state.currentVersion))
         print("Oudated symlinks:")
-        for state in sorted(outdatedLinks):
+        for state in resolution.outdated:
             print("\t{} {}: Current: {} Wanted: {}".format(state.plugin.name, state.plugin.versionSpec, state.currentVersion, state.wantedVersion))
         print("Missing plugins:")
-        for state in sorted(missing):
+        for state in resolution.missing:
             print("\t{}: {}".format(state.plugin.name, state.plugin.versionSpec))
         print("Unmanaged files:")
-        for state in sorted(unmanaged):
+        for state in resolution.unmanaged:
             print("\t{}".format(state.filename))
         print("Symlink Conflicts:")
-        for state in sorted(conflicts):
+        for state in resolution.conflicts:
             print("\t{}.jar".format(state.plugin.name))
 
 def do_server_add_plugin(args, config):
+    from mpm.model import Plugin, PluginSpec
     server = config.server(args.server)
     plugins = []
     for pluginSpec in args.plugin:
@@ -161,10 +314,8 @@ def do_server_add_plugin(args, config):
             plugin = Plugin(pluginSpec)
             pluginSpec = PluginSpec(plugin.name, str(plugin.version))
         else:
-            allVersions = []
-            for repo in config.repositories():
-                allVersions += repo.versionsForPlugin(pluginSpec)
-            pluginSpec = PluginSpec(pluginSpec, list(reversed(sorted(allVersions)))[0])
+            allVersions = config.catalog().versionsForPlugin(pluginSpec)
+            pluginSpec = PluginSpec(pluginSpec, allVersions[-1])
 
         plugins.append(pluginSpec)
 
@@ -182,16 +333,101 @@ def do_server_add_plugin(args, config):
     else:
         print("Cancelled.")
 
-def do_server_sync(args, config):
+def do_server_rollback(args, config):
+    server = config.server(args.name)
+    current = server.currentGeneration()
+    try:
+        generation = server.rollback(args.generation)
+    except ValueError as e:
+        print("Cannot roll back {}: {}".format(server.name, e))
+        sys.exit(1)
+    print("Rolled {} back from generation {} to {}".format(server.name, current, generation))
+
+def unchangedServers(args, config):
+    from mpm.lock import splitUnchanged
+    (servers, unchanged, catalogPrint) = splitUnchanged(config.servers(), config.catalog(), args.force)
+    for server in unchanged:
+        print("{}: unchanged since last sync".format(server.name))
+    return (servers, catalogPrint)
+
+def do_server_sync_plan(args, config):
+    from mpm.lock import writeLock
+    from mpm.plan import buildPlan, writePlan
+    from mpm.resolver import resolveNetwork
+    from mpm.verify import HashCache
+    (servers, catalogPrint) = unchangedServers(args, config)
+    resolutions = list(resolveNetwork(servers, config.catalog()))
+    plan = buildPlan(resolutions)
+    hashCache = HashCache()
+    for resolution in resolutions:
+        if resolution.server.name not in plan:
+            writeLock(resolution.server, catalogPrint, hashCache)
+    hashCache.save()
+    writePlan(plan, args.plan)
+    for (name, actions) in plan.items():
+        print("{}: {} changes".format(name, len(actions)))
+    print("Wrote plan to {}".format(args.plan))
+
+def do_server_sync_apply(args, config):
+    from mpm.plan import applyPlan, readPlan
+    plan = readPlan(args.apply)
+    servers = {name: config.server(name) for name in plan}
+    failed = 0
+    for result in applyPlan(plan, servers, args.jobs):
+        if result.error is None:
+            print("{}: applied {} changes".format(result.server.name, len(result.applied)))
+        else:
+            failed += 1
+            print("{}: failed after {} of {} changes: {}".format(result.server.name, len(result.applied), len(plan[result.server.name]), result.error))
+    if failed > 0:
+        sys.exit(1)
+
+def do_server_sync_locked(args, config):
+    from mpm.lock import Lockfile
+    from mpm.verify import HashCache
+    catalog = config.catalog()
+    hashCache = HashCache()
+    failed = 0
     for server in config.servers():
+        lock = Lockfile(server)
+        if lock.plugins is None:
+            print("{}: no lockfile".format(server.name))
+            continue
+        try:
+            (installs, versions) = lock.changes(catalog, hashCache)
+            for plugin in installs:
+                server.installVersion(plugin)
+                print("{}: installed {} {}".format(server.name, plugin.name, plugin.version))
+            if len(versions) == 0:
+                print("{}: matches lockfile".format(server.name))
+            else:
+                print("{}: switched to generation {}".format(server.name, server.applyVersions(versions)))
+        except (OSError, ValueError) as e:
+            failed += 1
+            print("{}: cannot deploy lockfile: {}".format(server.name, e))
+    hashCache.save()
+    if failed > 0:
+        sys.exit(1)
+
+def do_server_sync(args, config):
+    if args.plan is not None:
+        return do_server_sync_plan(args, config)
+    if args.apply is not None:
+        return do_server_sync_apply(args, config)
+    if args.locked:
+        return do_server_sync_locked(args, config)
+
+    from mpm.lock import writeLock
+    from mpm.resolver import resolveNetwork
+    from mpm.verify import HashCache
+
+    (servers, catalogPrint) = unchangedServers(args, config)
+    hashCache = HashCache()
+    for resolution in resolveNetwork(servers, config.catalog()):
+        server = resolution.server
         print('{} ({}):'.format(server.name, server.path))
-        outdatedLinks = []
-        available = []
-        for state in sorted(server.pluginStates(config.repositories())):
-            if isinstance(state, OutdatedSymlink):
-                outdatedLinks.append(state)
-            elif isinstance(state, Available):
-                available.append(state)
+        outdatedLinks = resolution.outdated
+        available = resolution.available
 
         print("Plugins to update:")
         for state in sorted(outdatedLinks):
@@ -204,21 +440,191 @@ def do_server_sync(args, config):
             print("Apply changes? [y/N]")
             answer = input().lower()
             if answer == "y":
+                versions = {}
                 for state in available:
                     server.installVersion(state.plugin)
-                    server.updateSymlinkForPlugin(state.plugin, state.plugin.version)
+                    versions[state.plugin.name] = state.plugin.version
                     print("Installed {} {}".format(state.plugin.name, state.plugin.version))
                 for state in outdatedLinks:
-                    server.updateSymlinkForPlugin(state.plugin, state.wantedVersion)
+                    versions[state.plugin.name] = state.wantedVersion
                     print("Updated {} to {}".format(state.plugin.name, state.wantedVersion))
+                generation = server.applyVersions(versions)
+                print("Switched to generation {}".format(generation))
+                writeLock(server, catalogPrint, hashCache)
             else:
                 print("Not applying changes.")
         else:
             print("No changes to apply.")
+            writeLock(server, catalogPrint, hashCache)
+    hashCache.save()
+
+def do_server_bundle(args, config):
+    from mpm.bundle import writeBundle
+    from mpm.resolver import ServerResolution
+    from mpm.verify import HashCache
+    server = config.server(args.name)
+    if server.transport.remote:
+        raise ValueError("Cannot bundle remote server {}".format(server.name))
+    resolution = ServerResolution(server, list(server.pluginStates(config.catalog())))
+    hashCache = HashCache()
+    output = args.output or '{}.tar'.format(server.name)
+    if output == '-':
+        plugins = writeBundle(resolution, sys.stdout.buffer, hashCache)
+    else:
+        tmp = output + '.tmp'
+        with open(tmp, 'wb') as fd:
+            plugins = writeBundle(resolution, fd, hashCache)
+        os.replace(tmp, output)
+    hashCache.save()
+    print("Bundled {} plugins of {} into {}".format(len(plugins), server.name, output), file=sys.stderr)
+
+def do_server_unpack(args, config):
+    from mpm.bundle import openBundle, unpackBundle
+    from mpm.server import Server
+    with (sys.stdin.buffer if args.archive == '-' else open(args.archive, 'rb')) as fd:
+        (archive, manifest) = openBundle(fd)
+        if args.path is not None:
+            server = Server(manifest['server'], {'path': args.path, 'plugins': []})
+        else:
+            server = config.server(args.server or manifest['server'])
+            if server.transport.remote:
+                raise ValueError("Cannot unpack into remote server {}".format(server.name))
+        (versions, generation) = unpackBundle(archive, manifest, server)
+    print("Unpacked {} plugins into {}, switched to generation {}".format(len(versions), server.path, generation))
+
+def describeUse(server, record):
+    description = "{} ({} {})".format(server, record['state'], record.get('spec', ''))
+    if 'target' in record:
+        description += " -> {}".format(record['target'])
+    elif 'source' in record:
+        description += " <- {}".format(record['source'])
+    return description
+
+def do_query_plugin(args, config):
+    from mpm.query import openIndex
+    versions = openIndex(config).versions(args.plugin)
+    if args.version is not None:
+        versions = {args.version: versions.get(args.version, [])}
+    if len(versions) == 0:
+        print("No servers use {}".format(args.plugin))
+    for (version, users) in sorted(versions.items(), key=lambda item: str(item[0])):
+        print("{} {}:".format(args.plugin, version))
+        for (server, record) in sorted(users, key=lambda user: user[0]):
+            print("\t{}".format(describeUse(server, record)))
+
+def do_query_jar(args, config):
+    from mpm.query import openIndex
+    users = openIndex(config).jarUsers(args.path)
+    if len(users) == 0:
+        print("No servers use {}".format(args.path))
+    for (server, record) in sorted(users, key=lambda user: user[0]):
+        print(describeUse(server, record))
+
+def whatIfOverride(value):
+    from mpm.whatif import parseOverride
+    try:
+        return parseOverride(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def do_plan_what_if(args, config):
+    from mpm.whatif import Scenario, WhatIf, parseOverride
+    whatIf = WhatIf(config.servers(), config.inheritance(), config.repositories())
+    scenarios = []
+    try:
+        if args.scenarios is not None:
+            with open(args.scenarios, 'r') as fd:
+                data = loadYaml(fd) or {}
+            for (name, entry) in (data.get('scenarios') or {}).items():
+                entry = entry or {}
+                overrides = dict(parseOverride('{}={}'.format(target, spec)) for (target, spec) in (entry.get('set') or {}).items())
+                repos = entry.get('repos')
+                scenarios.append(Scenario(name, overrides, None if repos is None else [whatIf.repository(repo) for repo in repos]))
+        if len(args.overrides) > 0 or len(args.repos) > 0 or len(scenarios) == 0:
+            repos = [whatIf.repository(repo) for repo in args.repos] or None
+            scenarios.append(Scenario('command line', dict(args.overrides), repos))
+        results = [(scenario, whatIf.evaluate(scenario)) for scenario in scenarios]
+    except (KeyError, ValueError) as e:
+        # Repository and server names can only be checked once the config
+        # is loaded, after argparse has run.
+        args.error(e.args[0] if isinstance(e, KeyError) else str(e))
+    if args.format == 'json':
+        from mpm.output import writeDocument
+        writeDocument({'scenarios': [{'name': scenario.name, 'servers': outcomes} for (scenario, outcomes) in results]})
+        return
+
+    for (scenario, outcomes) in results:
+        print("Scenario {}:".format(scenario.name))
+        for outcome in outcomes:
+            if len(outcome['changes']) == 0 and len(outcome['unsatisfiable']) == 0:
+                print("\t{}: no changes".format(outcome['server']))
+                continue
+            print("\t{}:".format(outcome['server']))
+            for change in outcome['changes']:
+                print("\t\t{} {}: {} -> {}".format(change['plugin'], change['spec'], change['current'] or 'not installed', change['target']))
+            for plugin in outcome['unsatisfiable']:
+                print("\t\t{} {}: unsatisfiable".format(plugin['plugin'], plugin['spec']))
+        changed = sum(1 for outcome in outcomes if len(outcome['changes']) > 0)
+        unsatisfiable = sum(len(outcome['unsatisfiable']) for outcome in outcomes)
+        print("\t{} servers change, {} unsatisfiable plugins".format(changed, unsatisfiable))
+
+def do_gc(args, config):
+    from mpm.gc import collect, dispose
+    from mpm.resolver import resolveNetwork
+    resolutions = list(resolveNetwork(config.servers(), config.catalog()))
+    repos = config.catalog().repos if args.repos else []
+    garbage = collect(resolutions, repos, args.keep)
+
+    if len(garbage) == 0:
+        print("Nothing to collect.")
+        return
+
+    owners = {}
+    for item in garbage:
+        owners.setdefault(item.owner, []).append(item)
+    for (owner, items) in sorted(owners.items()):
+        print("{}: {} files, {} bytes".format(owner, len(items), sum(item.size for item in items)))
+        for item in sorted(items, key=lambda item: item.path):
+            print("\t{}".format(item.path))
+    print("Total: {} files, {} bytes".format(len(garbage), sum(item.size for item in garbage)))
+
+    if args.dry_run:
+        return
+    if not args.yes:
+        print("{} these files? [y/N]".format("Archive" if args.archive else "Delete"))
+        if input().lower() != "y":
+            print("Cancelled.")
+            return
+    dispose(garbage, args.archive)
+    print("Collected!")
+
+def do_watch(args, config):
+    from mpm.watch import Watcher
+    watcher = Watcher(config, apply=args.apply)
+    print("Watching {} repositories and {} servers".format(len(watcher.catalog.repos), len(watcher.servers)))
+    try:
+        watcher.run(args.settle)
+    except KeyboardInterrupt:
+        pass
+
+def ioRate(value):
+    from mpm.throttle import parseSize
+    try:
+        return parseSize(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def addIoArguments(parser):
+    parser.add_argument('--bwlimit', type=ioRate, help='Limit copies to this many bytes per second (e.g. 20M)')
+    parser.add_argument('--io-jobs', type=int, help='Number of copies allowed to run at the same time')
+    parser.add_argument('--per-device', action='store_true', help='Apply --bwlimit and --io-jobs separately to each target filesystem')
 
 def main():
     parser = argparse.ArgumentParser(description='Paper Plugin Sync')
-    parser.add_argument('--config', dest='config_path', type=Config)
+    parser.add_argument('--config', dest='config_path', help='Path to the mpm config file (default: ~/mpm.yaml)')
+    parser.add_argument('--profile', action='store_true', help='Print per-phase timings and filesystem call counts to stderr')
+    parser.add_argument('--profile-json', help='Write per-phase timings and filesystem call counts to a JSON file')
+    parser.add_argument('--cprofile', help='Dump cProfile statistics for the run to a file')
     subparsers = parser.add_subparsers()
     repos = subparsers.add_parser('repo')
     repo_sub = repos.add_subparsers()
@@ -229,11 +635,16 @@ def main():
     repo_add.set_defaults(func=do_repo_add)
 
     repo_list = repo_sub.add_parser('list')
+    repo_list.add_argument('--format', choices=('text', 'json', 'ndjson'), default='text', help='Output format')
     repo_list.set_defaults(func=do_repo_list)
 
     repo_import = repo_sub.add_parser('import')
     repo_import.add_argument('name', help='Name of the repository')
-    repo_import.add_argument('path', nargs="+", help='Path of the plugin to import')
+    repo_import.add_argument('path', nargs="+", help='Plugin file, directory or glob to import')
+    repo_import.add_argument('--jobs', type=int, default=None, help='Number of processes used to verify plugins')
+    repo_import.add_argument('--copy-jobs', type=int, default=None, help='Number of plugins copied in parallel')
+    repo_import.add_argument('--yes', action='store_true', help='Do not ask for confirmation')
+    addIoArguments(repo_import)
     repo_import.set_defaults(func=do_repo_import)
 
     servers = subparsers.add_parser('server')
@@ -241,9 +652,11 @@ def main():
     server_add = server_sub.add_parser('add')
     server_add.add_argument('name', help='Name for the server')
     server_add.add_argument('path', help='Path to your server\'s root directory')
+    server_add.add_argument('--transport', help='Command that runs a shell on the host holding path, e.g. "ssh mc-2"')
     server_add.set_defaults(func=do_server_add)
 
     server_list = server_sub.add_parser('list')
+    server_list.add_argument('--format', choices=('text', 'json', 'ndjson'), default='text', help='Output format')
     server_list.set_defaults(func=do_server_list)
 
     server_add_plugin = server_sub.add_parser('add-plugin')
@@ -251,17 +664,98 @@ def main():
     server_add_plugin.add_argument('plugin', nargs='+', help='Plugin file or spec to install')
     server_add_plugin.set_defaults(func=do_server_add_plugin)
 
+    server_rollback = server_sub.add_parser('rollback')
+    server_rollback.add_argument('name', help='Name of the server')
+    server_rollback.add_argument('--to', dest='generation', type=int, help='Generation to switch to (default: the previous one)')
+    server_rollback.set_defaults(func=do_server_rollback)
+
+    server_bundle = server_sub.add_parser('bundle')
+    server_bundle.add_argument('name', help='Name of the server')
+    server_bundle.add_argument('--output', '-o', help='Archive to write, or - for stdout (default: <name>.tar)')
+    server_bundle.set_defaults(func=do_server_bundle)
+
+    server_unpack = server_sub.add_parser('unpack')
+    server_unpack.add_argument('archive', help='Bundle written by server bundle, or - for stdin')
+    server_unpack_target = server_unpack.add_mutually_exclusive_group()
+    server_unpack_target.add_argument('--server', help='Configured server to unpack into (default: the bundled server)')
+    server_unpack_target.add_argument('--path', help='Server directory to unpack into without a configured server')
+    server_unpack.set_defaults(func=do_server_unpack)
+
     server_sync = server_sub.add_parser('sync')
+    server_sync_mode = server_sync.add_mutually_exclusive_group()
+    server_sync_mode.add_argument('--plan', help='Write the pending changes to a plan file instead of prompting')
+    server_sync_mode.add_argument('--apply', help='Apply a plan file written by --plan without prompting')
+    server_sync_mode.add_argument('--locked', action='store_true', help='Deploy exactly the versions recorded in each server\'s lockfile')
+    server_sync.add_argument('--force', action='store_true', help='Resolve servers even if nothing changed since their last sync')
+    server_sync.add_argument('--jobs', type=int, default=1, help='Number of servers to apply in parallel')
+    addIoArguments(server_sync)
     server_sync.set_defaults(func=do_server_sync)
 
+    query = subparsers.add_parser('query')
+    query_sub = query.add_subparsers()
+    query_plugin = query_sub.add_parser('plugin')
+    query_plugin.add_argument('plugin', help='Name of the plugin')
+    query_plugin.add_argument('--version', help='Only show servers on this version')
+    query_plugin.set_defaults(func=do_query_plugin)
+
+    query_jar = query_sub.add_parser('jar')
+    query_jar.add_argument('path', help='Repo or server jar to look up')
+    query_jar.set_defaults(func=do_query_jar)
+
+    plan = subparsers.add_parser('plan')
+    plan_sub = plan.add_subparsers()
+    plan_what_if = plan_sub.add_parser('what-if')
+    plan_what_if.add_argument('--set', dest='overrides', action='append', default=[], type=whatIfOverride, help='Override a spec, as PLUGIN=SPEC or SERVER:PLUGIN=SPEC')
+    plan_what_if.add_argument('--repo', dest='repos', action='append', default=[], help='Resolve against this repository name or directory only (repeatable)')
+    plan_what_if.add_argument('--scenarios', help='YAML file with named scenarios to evaluate')
+    plan_what_if.add_argument('--format', choices=('text', 'json'), default='text', help='Output format')
+    plan_what_if.set_defaults(func=do_plan_what_if, error=plan_what_if.error)
+
+    gc = subparsers.add_parser('gc')
+    gc.add_argument('--keep', type=int, default=1, help='Unused versions to keep per plugin for rollbacks')
+    gc.add_argument('--archive', help='Move collected jars into this directory instead of deleting them')
+    gc.add_argument('--no-repos', dest='repos', action='store_false', help='Only collect from server plugin directories')
+    gc.add_argument('--dry-run', action='store_true', help='Only report what would be collected')
+    gc.add_argument('--yes', action='store_true', help='Do not ask for confirmation')
+    gc.set_defaults(func=do_gc)
+
+    watch = subparsers.add_parser('watch')
+    watch.add_argument('--apply', action='store_true', help='Apply changes as they are detected instead of only logging them')
+    watch.add_argument('--settle', type=float, default=0.2, help='Seconds to wait for a burst of file events to finish')
+    watch.set_defaults(func=do_watch)
+
     args = parser.parse_args()
 
-    config = Config(args.config_path)
+    profiler = None
+    if args.profile or args.profile_json is not None or args.cprofile is not None:
+        profiler = instrument.enable(cprofile=args.cprofile is not None)
 
-    if 'func' not in args:
-        parser.print_usage()
-    else:
-        args.func(args, config)
+    scheduler = None
+    if getattr(args, 'bwlimit', None) is not None or getattr(args, 'io_jobs', None) is not None:
+        from mpm import throttle
+        scheduler = throttle.enable(args.bwlimit, args.io_jobs, args.per_device)
+
+    try:
+        with instrument.phase('config'):
+            config = Config(args.config_path)
+
+        if 'func' not in args:
+            parser.print_usage()
+        else:
+            with instrument.phase('command'):
+                args.func(args, config)
+    finally:
+        if scheduler is not None:
+            throttle.disable()
+            scheduler.printReport()
+        if profiler is not None:
+            instrument.disable()
+            if args.profile:
+                profiler.printSummary()
+            if args.profile_json is not None:
+                profiler.writeJson(args.profile_json)
+            if args.cprofile is not None:
+                profiler.dumpCProfile(args.cprofile)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,138 @@
+from array import array
+from bisect import bisect_right
+import re
+
+COMPONENT_BITS = 20
+COMPONENT_LIMIT = 1 << COMPONENT_BITS
+MAX_PACKED = (1 << (3 * COMPONENT_BITS)) - 1
+
+def packVersion(version):
+    if version.prerelease or version.build:
+        return None
+    if max(version.major, version.minor, version.patch) >= COMPONENT_LIMIT:
+        return None
+    return (version.major << (2 * COMPONENT_BITS)) | (version.minor << COMPONENT_BITS) | version.patch
+
+release_pattern = re.compile(r'^(0|[1-9]\d*)\.(0|[1-9]\d*)\.(0|[1-9]\d*)$')
+
+def packVersionString(version):
+    matches = release_pattern.match(version)
+    if matches is None:
+        return None
+    (major, minor, patch) = (int(component) for component in matches.groups())
+    if max(major, minor, patch) >= COMPONENT_LIMIT:
+        return None
+    return (major << (2 * COMPONENT_BITS)) | (minor << COMPONENT_BITS) | patch
+
+def intersect(a, b):
+    result = []
+    (i, j) = (0, 0)
+    while i < len(a) and j < len(b):
+        lo = max(a[i][0], b[j][0])
+        hi = min(a[i][1], b[j][1])
+        if lo <= hi:
+            result.append((lo, hi))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+def union(intervals):
+    result = []
+    for (lo, hi) in sorted(intervals):
+        if len(result) > 0 and lo <= result[-1][1] + 1:
+            result[-1] = (result[-1][0], max(result[-1][1], hi))
+        else:
+            result.append((lo, hi))
+    return result
+
+def compileClause(clause):
+    from semantic_version import base
+    if isinstance(clause, base.Always):
+        return [(0, MAX_PACKED)]
+    if isinstance(clause, base.Never):
+        return []
+    if isinstance(clause, base.AllOf):
+        intervals = [(0, MAX_PACKED)]
+        for child in clause.clauses:
+            intervals = intersect(intervals, compileClause(child))
+        return intervals
+    if isinstance(clause, base.AnyOf):
+        intervals = []
+        for child in clause.clauses:
+            intervals += compileClause(child)
+        return union(intervals)
+    if isinstance(clause, base.Range):
+        target = packVersion(clause.target)
+        if target is None:
+            raise ValueError("Cannot compile range on {}".format(clause.target))
+        return {
+            '==': [(target, target)],
+            '!=': union([(0, target - 1), (target + 1, MAX_PACKED)]),
+            '<': [(0, target - 1)],
+            '<=': [(0, target)],
+            '>': [(target + 1, MAX_PACKED)],
+            '>=': [(target, MAX_PACKED)],
+        }[clause.operator]
+    raise ValueError("Cannot compile clause {!r}".format(clause))
+
+def compileSpec(versionSpec):
+    try:
+        return [(lo, hi) for (lo, hi) in compileClause(versionSpec.clause) if lo <= hi]
+    except (ValueError, KeyError, AttributeError):
+        return None
+
+class SortedVersions:
+    def __init__(self, items, key=None, packKey=None):
+        self.key = key or (lambda item: item)
+        packKey = packKey or (lambda item: packVersion(self.key(item)))
+        packed = []
+        self.unpacked = []
+        for item in items:
+            packedVersion = packKey(item)
+            if packedVersion is None:
+                self.unpacked.append(item)
+            else:
+                packed.append((packedVersion, item))
+        packed.sort(key=lambda pair: pair[0])
+        self.packed = array('Q', (packedVersion for (packedVersion, item) in packed))
+        self.packedItems = [item for (packedVersion, item) in packed]
+        self.unpacked.sort(key=self.key)
+        self.sortedItems = None
+
+    @property
+    def items(self):
+        if self.sortedItems is None:
+            if len(self.unpacked) == 0:
+                self.sortedItems = self.packedItems
+            else:
+                self.sortedItems = sorted(self.packedItems + self.unpacked, key=self.key)
+        return self.sortedItems
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.packedItems) + len(self.unpacked)
+
+    def newest(self, pluginSpec):
+        intervals = pluginSpec.intervals()
+        if intervals is None:
+            for item in reversed(self.items):
+                if self.key(item) in pluginSpec.versionSpec:
+                    return item
+            return None
+
+        best = None
+        for (lo, hi) in reversed(intervals):
+            index = bisect_right(self.packed, hi) - 1
+            if index >= 0 and self.packed[index] >= lo:
+                best = self.packedItems[index]
+                break
+        for item in reversed(self.unpacked):
+            if best is not None and self.key(item) <= self.key(best):
+                break
+            if self.key(item) in pluginSpec.versionSpec:
+                return item
+        return best
@@ -1,26 +1,61 @@
-from semantic_version import Spec, Version
 from functools import total_ordering
+from mpm.jar import readPluginMetadata
+from mpm.matching import compileSpec
 import os
 import re
+import sys
 
 version_pattern = re.compile('^(?P<name>.+)-(?P<version>(?:\.?\d+)+).+jar$')
 
+# semantic_version pulls in importlib.metadata, which is a noticeable part of
+# mpm's startup time, so it is only imported once a version is parsed.
+def parseVersion(version):
+    from semantic_version import Version
+    return Version(version)
+
+def coerceVersion(version):
+    from semantic_version import Version
+    return Version.coerce(version)
+
+def parseSpec(versionSpec):
+    from semantic_version import Spec
+    return Spec(versionSpec)
+
 @total_ordering
 class Plugin:
-    def __init__(self, path):
+    __slots__ = ('path', 'name', 'rawVersion', 'parsedVersion')
+
+    def __init__(self, path, name=None, version=None):
         self.path = path
+        if name is not None:
+            # Catalogs hold tens of thousands of these, most of which are
+            # never compared, so the version is only parsed on first use.
+            self.name = sys.intern(name)
+            self.rawVersion = str(version)
+            self.parsedVersion = None
+            return
+
         pluginName = os.path.basename(path)
         pluginMatches = version_pattern.match(pluginName)
 
+        if pluginMatches is None:
+            pluginMatches = readPluginMetadata(path)
         if pluginMatches is None:
             raise ValueError("Cannot derive plugin name from '{}'".format(path))
 
-        self.name = pluginMatches['name']
+        self.name = sys.intern(pluginMatches['name'])
 
         try:
-            self.version = Version.coerce(pluginMatches['version'])
+            self.parsedVersion = coerceVersion(pluginMatches['version'])
         except ValueError:
             raise ValueError("Cannot derive semver from '{}'".format(path))
+        self.rawVersion = str(self.parsedVersion)
+
+    @property
+    def version(self):
+        if self.parsedVersion is None:
+            self.parsedVersion = parseVersion(self.rawVersion)
+        return self.parsedVersion
 
     def __eq__(self, other):
         return self.name == other.name and self.version == other.version
@@ -35,12 +70,22 @@ class Plugin:
 
 @total_ordering
 class PluginSpec:
+    __slots__ = ('name', 'versionSpec', 'compiledIntervals', 'compiled')
+
     def __init__(self, name, versionSpec):
-        self.name = name
+        self.name = sys.intern(name)
         try:
-            self.versionSpec = Spec(str(versionSpec))
+            self.versionSpec = parseSpec(str(versionSpec))
         except ValueError:
             raise ValueError("Invalid version spec for plugin {}: {}".format(name, versionSpec))
+        self.compiledIntervals = None
+        self.compiled = False
+
+    def intervals(self):
+        if not self.compiled:
+            self.compiledIntervals = compileSpec(self.versionSpec)
+            self.compiled = True
+        return self.compiledIntervals
 
     def __str__(self):
         return "{} {}".format(self.name, self.versionSpec)
@@ -56,6 +101,8 @@ class PluginSpec:
 
 @total_ordering
 class PluginState:
+    __slots__ = ('plugin',)
+
     def __init__(self, plugin):
         self.plugin = plugin
 
@@ -69,6 +116,8 @@ class PluginState:
         return self.plugin.name < other.plugin.name
 
 class UnmanagedFile(PluginState):
+    __slots__ = ('filename',)
+
     def __init__(self, filename):
         self.filename = filename
 
@@ -76,22 +125,28 @@ class UnmanagedFile(PluginState):
         return self.filename < other.filename
 
 class OutdatedSymlink(PluginState):
+    __slots__ = ('currentVersion', 'wantedVersion')
+
     def __init__(self, plugin, currentVersion, wantedVersion):
         super().__init__(plugin)
         self.currentVersion = currentVersion
         self.wantedVersion = wantedVersion
 
 class SymlinkConflict(PluginState):
-    pass
+    __slots__ = ()
 
 class MissingVersions(PluginState):
-    pass
+    __slots__ = ()
 
 class Available(PluginState):
+    __slots__ = ()
+
     def __init__(self, repoPlugin):
         super().__init__(repoPlugin)
 
 class Installed(PluginState):
+    __slots__ = ('currentVersion',)
+
     def __init__(self, plugin, currentVersion):
         super().__init__(plugin)
         self.currentVersion = currentVersion
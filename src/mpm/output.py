@@ -0,0 +1,50 @@
+import json
+import sys
+from mpm.model import *
+
+STATE_NAMES = (
+    (OutdatedSymlink, 'outdated'),
+    (Installed, 'installed'),
+    (Available, 'available'),
+    (MissingVersions, 'missing'),
+    (UnmanagedFile, 'unmanaged'),
+    (SymlinkConflict, 'conflict'),
+)
+
+def optionalStr(value):
+    return None if value is None else str(value)
+
+def stateName(state):
+    for (stateType, name) in STATE_NAMES:
+        if isinstance(state, stateType):
+            return name
+    raise ValueError("Unknown plugin state {}".format(state))
+
+def stateRecord(state):
+    record = {'state': stateName(state)}
+    if isinstance(state, UnmanagedFile):
+        record['file'] = state.filename
+        return record
+    record['plugin'] = state.plugin.name
+    if isinstance(state, Available):
+        record['version'] = str(state.plugin.version)
+        record['source'] = state.plugin.path
+        return record
+    record['spec'] = str(state.plugin.versionSpec)
+    if isinstance(state, (Installed, OutdatedSymlink)):
+        record['current'] = optionalStr(state.currentVersion)
+    if isinstance(state, OutdatedSymlink):
+        record['wanted'] = optionalStr(state.wantedVersion)
+    return record
+
+def pluginRecord(plugin):
+    return {'plugin': plugin.name, 'version': plugin.rawVersion, 'path': plugin.path}
+
+def writeRecord(record, stream=sys.stdout):
+    stream.write(json.dumps(record))
+    stream.write('\n')
+    stream.flush()
+
+def writeDocument(document, stream=sys.stdout):
+    json.dump(document, stream, indent=2)
+    stream.write('\n')
@@ -0,0 +1,72 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from mpm.model import *
+from mpm import instrument
+
+PLAN_VERSION = 1
+
+def buildPlan(resolutions):
+    plan = {}
+    for resolution in resolutions:
+        actions = []
+        for state in resolution.available:
+            actions.append({
+                'action': 'install',
+                'name': state.plugin.name,
+                'version': str(state.plugin.version),
+                'source': state.plugin.path,
+            })
+        for state in resolution.outdated:
+            actions.append({
+                'action': 'link',
+                'name': state.plugin.name,
+                'version': str(state.wantedVersion),
+            })
+        if len(actions) > 0:
+            plan[resolution.server.name] = actions
+    return plan
+
+def writePlan(plan, path):
+    with open(path, 'w') as fd:
+        json.dump({'version': PLAN_VERSION, 'servers': plan}, fd, indent=2)
+
+def readPlan(path):
+    with open(path, 'r') as fd:
+        data = json.load(fd)
+    if data.get('version') != PLAN_VERSION:
+        raise ValueError("Unsupported plan version in {}".format(path))
+    return data['servers']
+
+class ServerResult:
+    def __init__(self, server):
+        self.server = server
+        self.applied = []
+        self.error = None
+
+def applyActions(server, actions):
+    with instrument.server(server.name):
+        return applyServerActions(server, actions)
+
+def applyServerActions(server, actions):
+    result = ServerResult(server)
+    versions = {}
+    try:
+        for action in actions:
+            plugin = Plugin(action.get('source'), action['name'], action['version'])
+            if action['action'] == 'install':
+                server.installVersion(plugin)
+            elif action['action'] != 'link':
+                raise ValueError("Unknown plan action {}".format(action['action']))
+            versions[plugin.name] = plugin.version
+        # Links for every action switch together in one new generation.
+        server.applyVersions(versions)
+        result.applied = list(actions)
+    except (OSError, ValueError) as e:
+        result.error = e
+    return result
+
+def applyPlan(plan, servers, jobs=1):
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(applyActions, servers[name], actions) for (name, actions) in plan.items()]
+        for future in futures:
+            yield future.result()
@@ -0,0 +1,113 @@
+import json
+import os
+from mpm.model import *
+from mpm.output import stateRecord
+from mpm.resolver import ServerResolution
+
+INDEX_VERSION = 1
+CATALOG_STATES = ('available', 'missing')
+
+def serverFingerprint(server):
+    return [
+        server.path,
+        sorted(str(spec) for spec in server.plugins()),
+        server.transport.mtime(server.pluginPath),
+        server.transport.mtime(os.path.join(server.pluginPath, 'versions')),
+        server.transport.mtime(server.generationsPath()),
+    ]
+
+def catalogFingerprint(catalog):
+    return [[repo.name, repo.path, repo.refreshIndex().fingerprint()] for repo in catalog.repos]
+
+def serverRecords(server, catalog):
+    records = []
+    for state in ServerResolution(server, list(server.pluginStates(catalog))).states:
+        if isinstance(state, UnmanagedFile):
+            continue
+        record = stateRecord(state)
+        if isinstance(state, Available):
+            record['spec'] = str(next(spec.versionSpec for spec in server.plugins() if spec.name == state.plugin.name))
+        if isinstance(state, (Installed, OutdatedSymlink)):
+            target = server.resolveLink(state.plugin.name)
+            if target is not None:
+                record['target'] = target
+        records.append(record)
+    return records
+
+class ReverseIndex:
+    def __init__(self, path):
+        self.path = path
+        self.catalog = None
+        self.servers = {}
+        self.byPlugin = None
+        try:
+            with open(path, 'r') as fd:
+                data = json.load(fd)
+            if data.get('version') == INDEX_VERSION:
+                self.catalog = data['catalog']
+                self.servers = data['servers']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as fd:
+            json.dump({'version': INDEX_VERSION, 'catalog': self.catalog, 'servers': self.servers}, fd)
+        os.replace(tmp, self.path)
+
+    def update(self, servers, catalog):
+        catalogChanged = catalogFingerprint(catalog) != self.catalog
+        self.catalog = catalogFingerprint(catalog)
+        updated = []
+        current = {}
+        for server in servers:
+            fingerprint = serverFingerprint(server)
+            entry = self.servers.get(server.name)
+            stale = entry is None or entry['fingerprint'] != fingerprint
+            if not stale and catalogChanged:
+                stale = any(record['state'] in CATALOG_STATES for record in entry['records'])
+            if stale:
+                entry = {'fingerprint': fingerprint, 'records': serverRecords(server, catalog)}
+                updated.append(server.name)
+            current[server.name] = entry
+        changed = len(updated) > 0 or current.keys() != self.servers.keys()
+        self.servers = current
+        self.byPlugin = None
+        return (updated, changed)
+
+    def index(self):
+        if self.byPlugin is None:
+            self.byPlugin = {}
+            for (name, entry) in self.servers.items():
+                for record in entry['records']:
+                    version = record.get('current') or record.get('version')
+                    self.byPlugin.setdefault(record['plugin'], {}).setdefault(version, []).append((name, record))
+        return self.byPlugin
+
+    def versions(self, pluginName):
+        return self.index().get(pluginName, {})
+
+    def serversUsing(self, pluginName, version=None):
+        versions = self.versions(pluginName)
+        if version is not None:
+            return versions.get(version, [])
+        return [user for users in versions.values() for user in users]
+
+    def jarUsers(self, jarPath):
+        jarPath = os.path.abspath(jarPath)
+        users = []
+        for (name, entry) in self.servers.items():
+            for record in entry['records']:
+                if jarPath in (record.get('target'), record.get('source')):
+                    users.append((name, record))
+        return users
+
+def openIndex(config):
+    index = ReverseIndex(config.sidecarPath('query.json'))
+    (updated, changed) = index.update(config.servers(), config.catalog())
+    if changed:
+        try:
+            index.save()
+        except OSError:
+            pass
+    return index
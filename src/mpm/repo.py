@@ -1,110 +1,116 @@
+import glob
 import os
 from mpm.model import *
-import shutil
+from mpm.index import RepoIndex
+from mpm.matching import SortedVersions, packVersionString
+from mpm import instrument, snapshot
+from mpm.store import BlobStore, hashFile, linkOrCopy
+
+IMPORT_JOBS = 4
+
+def findJars(patterns):
+    seen = set()
+    for pattern in patterns:
+        # A path that matches nothing is passed through so the caller can
+        # report it instead of silently importing nothing.
+        matches = sorted(glob.glob(pattern, recursive=True)) or [pattern]
+        for match in matches:
+            if os.path.isdir(match):
+                paths = []
+                for (root, dirs, files) in os.walk(match):
+                    dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                    paths += [os.path.join(root, f) for f in sorted(files) if f.endswith('.jar') and not f.startswith('.')]
+            else:
+                paths = [match]
+            for path in paths:
+                if os.path.abspath(path) not in seen:
+                    seen.add(os.path.abspath(path))
+                    yield path
+
+def parsePlugin(path):
+    plugin = Plugin(path)
+    return (plugin.name, str(plugin.version))
 
 class Repo:
     def __init__(self, name, config):
         self.name = name
         self.config = config
         self.path = config['path']
+        self.index = None
+        self.indexFresh = False
+        self.contents = None
+        self.store = BlobStore(self.path)
+
+    def invalidate(self):
+        self.indexFresh = False
+        self.contents = None
 
-    def importPlugin(self, plugin):
+    def importPlugin(self, plugin, digest=None):
         dest = "{}/{}-{}.jar".format(self.path, plugin.name, plugin.version)
-        shutil.copyfile(plugin.path, dest)
+        digest = self.store.add(plugin.path, digest)
+        linkOrCopy(self.store.blobPath(digest), dest)
+        snapshot.invalidate(self.path)
+        self.invalidate()
+
+    def importPlugins(self, plugins, digests, jobs=None):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=jobs or IMPORT_JOBS) as pool:
+            futures = [(plugin, pool.submit(self.importPlugin, plugin, digests.get(plugin.path))) for plugin in plugins]
+            for (plugin, future) in futures:
+                try:
+                    future.result()
+                    yield (plugin, None)
+                except OSError as e:
+                    yield (plugin, e)
+
+    def refreshIndex(self):
+        if self.index is None:
+            self.index = RepoIndex(self.path)
+        if not self.indexFresh:
+            # Refreshing stats every jar, so it is done once per command
+            # unless the repo is invalidated (by an import, or by watch).
+            with instrument.phase('repo-index'):
+                self.index.refresh(parsePlugin)
+            self.indexFresh = True
+        return self.index
 
     def plugins(self):
-        plugins = os.listdir(self.path)
-        for pluginFile in plugins:
-            fullPath = os.path.join(self.path, pluginFile)
-            if os.path.isfile(fullPath):
-                try:
-                    yield Plugin(fullPath)
-                except ValueError:
-                    continue
+        for (filename, name, version, size, mtime) in self.refreshIndex().plugins():
+            yield Plugin(os.path.join(self.path, filename), name, version)
 
-    def versionsForPlugin(self, name):
+    def sortedPlugins(self):
+        # Plain releases sort on their packed version string, so listing a
+        # repo only imports semantic_version for prereleases and builds.
+        byName = {}
         for plugin in self.plugins():
-            if plugin.name == name:
-                yield plugin.version
-
-    def badFiles(self):
-        plugins = os.listdir(self.path)
-        for pluginFile in plugins:
-            fullPath = os.path.join(self.path, pluginFile)
-            if os.path.isfile(fullPath):
-                try:
-                    Plugin(fullPath)
-                except ValueError:
-                    yield fullPath
-
-class Server:
-    def __init__(self, path, pluginSet):
-        self.path = path
-        self.pluginSet = pluginSet
-
-    def updateSymlinkForPlugin(self, plugin, version):
-        pluginFilename = os.path.join(self.path, 'plugins/versions/{}-{}.jar'.format(plugin.name, version))
-        pluginSymlink = os.path.join(self.path, plugin.name + '.jar')
-        linkDst = os.path.relpath(pluginFilename, self.path)
-
-        if os.path.lexists(pluginSymlink):
-            os.unlink(pluginSymlink)
-        os.symlink(linkDst, pluginSymlink)
+            byName.setdefault(plugin.name, []).append(plugin)
+        for name in sorted(byName):
+            yield from SortedVersions(byName[name], lambda plugin: plugin.version, lambda plugin: packVersionString(plugin.rawVersion))
 
-    def pluginStates(self):
-        managedPluginFilenames = []
-        for plugin in self.pluginSet:
-            compatibleVersions = []
-            pluginLinkName = '{}.jar'.format(plugin.name)
-            managedPluginFilenames.append(pluginLinkName)
-
-            if os.path.exists(os.path.join(self.path, pluginLinkName)) and not os.path.islink(os.path.join(self.path, pluginLinkName)):
-                yield SymlinkConflict(plugin)
-                continue
-
-            for installedVersion in self.versionsForPlugin(plugin.name):
-                if installedVersion in plugin.versionSpec:
-                    compatibleVersions.append(installedVersion)
-
-            if len(compatibleVersions) == 0:
-                yield MissingVersions(plugin)
-            else:
-                preferredVersion = list(reversed(sorted(compatibleVersions)))[0]
-                currentVersion = self.currentVersionForPlugin(plugin.name)
-
-                if currentVersion == preferredVersion:
-                    yield Installed(plugin, currentVersion)
-                else:
-                    yield OutdatedSymlink(plugin, currentVersion, preferredVersion)
-
-        otherPlugins = os.listdir(self.path)
-        for pluginFile in otherPlugins:
-            if os.path.isfile(os.path.join(self.path, pluginFile)) and pluginFile not in managedPluginFilenames:
-                yield UnmanagedFile(pluginFile)
-
-    def currentVersionForPlugin(self, pluginName):
-        pluginSymlink = os.path.join(self.path, pluginName + '.jar')
-        if not os.path.lexists(pluginSymlink):
-            return None
-        suffix = '.jar'
-        pluginJar = os.path.basename(os.readlink(pluginSymlink))
-        jarVersion = pluginJar[len(pluginName)+1:len(pluginJar)-len(suffix)]
-        try:
-            pluginSemver = Version.coerce(jarVersion)
-        except ValueError:
-            pluginSemver = jarVersion
-        return pluginSemver
-
-    def versionsForPlugin(self, pluginName):
-        plugins = os.listdir(os.path.join(self.path, 'plugins', 'versions'))
-        for pluginJar in plugins:
-            if pluginJar.startswith(pluginName):
-                prefix = pluginName + '-'
-                suffix = '.jar'
-                jarVersion = pluginJar[len(prefix):len(pluginJar)-len(suffix)]
-                try:
-                    pluginSemver = Version.coerce(jarVersion)
-                except ValueError:
-                    pluginSemver = jarVersion
-                yield pluginSemver
+    def versionsForPlugin(self, name):
+        for (filename, pluginName, version, size, mtime) in self.refreshIndex().plugins():
+            if pluginName == name:
+                yield parseVersion(version)
+
+    def presentPlugins(self):
+        return {(name, version, size) for (filename, name, version, size, mtime) in self.refreshIndex().plugins()}
+
+    def containsContent(self, digest, size, hashCache):
+        if self.store.contains(digest):
+            return True
+        if self.contents is None:
+            self.contents = {}
+            for (filename, name, version, fileSize, mtime) in self.refreshIndex().plugins():
+                self.contents.setdefault(fileSize, []).append(os.path.join(self.path, filename))
+        for path in self.contents.get(size, ()):
+            cached = hashCache.get(path)
+            if cached is None:
+                cached = (hashFile(path), None)
+                hashCache.put(path, *cached)
+            if cached[0] == digest:
+                return True
+        return False
 
+    def badFiles(self):
+        for filename in self.refreshIndex().badFiles():
+            yield os.path.join(self.path, filename)
@@ -0,0 +1,92 @@
+from mpm.model import *
+from mpm import instrument
+from mpm.matching import SortedVersions, packVersionString
+
+def parseJarVersion(pluginName, filename):
+    jarVersion = filename[len(pluginName)+1:len(filename)-len('.jar')]
+    try:
+        return coerceVersion(jarVersion)
+    except ValueError:
+        return jarVersion
+
+versionsCache = {}
+
+def scanVersions(listing):
+    # Parsed listings are kept for as long as the directory snapshot they
+    # came from, so repeated resolutions of a server only parse it once.
+    cached = versionsCache.get(listing.path)
+    if cached is not None and cached[0] is listing:
+        return cached[1]
+    with instrument.phase('versions-scan'):
+        versions = scanVersionsIn(listing)
+    versionsCache[listing.path] = (listing, versions)
+    return versions
+
+def scanVersionsIn(listing):
+    versions = {}
+    for filename in listing.names():
+        if not filename.endswith('.jar'):
+            continue
+        dash = filename.find('-')
+        while dash != -1:
+            version = parseJarVersion(filename[:dash], filename)
+            if not isinstance(version, str):
+                versions.setdefault(filename[:dash], []).append(version)
+            dash = filename.find('-', dash + 1)
+    return {name: SortedVersions(pluginVersions) for (name, pluginVersions) in versions.items()}
+
+class Catalog:
+    def __init__(self, repos):
+        self.repos = repos
+        self.plugins = None
+
+    def load(self):
+        if self.plugins is not None:
+            return self.plugins
+        with instrument.phase('catalog'):
+            plugins = {}
+            for repo in self.repos:
+                for plugin in repo.plugins():
+                    plugins.setdefault(plugin.name, []).append(plugin)
+            # Plain releases are ordered by their packed index string, so only
+            # prereleases and builds need a parsed Version to be sorted.
+            plugins = {name: SortedVersions(versions, lambda plugin: plugin.version, lambda plugin: packVersionString(plugin.rawVersion)) for (name, versions) in plugins.items()}
+        self.plugins = plugins
+        return self.plugins
+
+    def invalidate(self):
+        self.plugins = None
+        for repo in self.repos:
+            repo.invalidate()
+
+    def versionsForPlugin(self, name):
+        return [plugin.version for plugin in self.load().get(name, ())]
+
+    def hasVersion(self, name, version):
+        return any(plugin.rawVersion == str(version) for plugin in self.load().get(name, ()))
+
+    def bestMatch(self, pluginSpec):
+        versions = self.load().get(pluginSpec.name)
+        if versions is None:
+            return None
+        return versions.newest(pluginSpec)
+
+class ServerResolution:
+    def __init__(self, server, states):
+        self.server = server
+        self.states = states
+        self.installed = sorted(s for s in states if isinstance(s, Installed))
+        self.outdated = sorted(s for s in states if isinstance(s, OutdatedSymlink))
+        self.available = sorted(s for s in states if isinstance(s, Available))
+        self.missing = sorted(s for s in states if isinstance(s, MissingVersions))
+        self.unmanaged = sorted(s for s in states if isinstance(s, UnmanagedFile))
+        self.conflicts = sorted(s for s in states if isinstance(s, SymlinkConflict))
+
+    def hasChanges(self):
+        return len(self.outdated) > 0 or len(self.available) > 0
+
+def resolveNetwork(servers, catalog):
+    for server in servers:
+        with instrument.server(server.name):
+            states = list(server.pluginStates(catalog))
+        yield ServerResolution(server, states)
@@ -1,49 +1,90 @@
 from mpm.model import *
-import shutil
+from mpm.matching import SortedVersions
+from mpm.resolver import Catalog, parseJarVersion, scanVersions
+from mpm.store import BlobStore
+from mpm.transport import openTransport
+
+GENERATIONS_DIRNAME = '.generations'
+CURRENT_GENERATION = 'current'
+KEEP_GENERATIONS = 5
+
+class Inheritance:
+    def __init__(self, servers):
+        self.servers = servers
+        self.flattened = {}
+
+    def invalidate(self):
+        self.flattened = {}
+
+    def plugins(self, name, path=()):
+        if name in self.flattened:
+            return self.flattened[name]
+        if name in path:
+            raise ValueError("Inheritance cycle: {}".format(' -> '.join(path + (name,))))
+        if name not in self.servers:
+            raise KeyError("Cannot inherit from unknown server {}".format(name))
+
+        config = self.servers[name]
+        specs = {}
+        for parent in config.get('inherit') or ():
+            specs.update(self.plugins(parent, path + (name,)))
+        for p in config.get('plugins') or ():
+            specs[p['name']] = PluginSpec(p['name'], p.get('version', '*'))
+        self.flattened[name] = specs
+        return specs
 
 class Server:
-    def __init__(self, name, config):
+    def __init__(self, name, config, inheritance=None, transport=None):
         self.name = name
         self.config = config
         self.path = config['path']
-        self.pluginPath = self.path+'/plugins'
+        self.pluginPath = os.path.normpath(os.path.join(self.path, 'plugins'))
+        self.inheritance = inheritance or Inheritance({name: config})
+        self.transport = transport or openTransport(config)
 
     def plugins(self):
-        return [PluginSpec(p['name'], p['version']) for p in self.config['plugins']]
+        return list(self.inheritance.plugins(self.name).values())
 
     def add_plugin(self, pluginSpec):
         for plugin in self.config['plugins']:
             if plugin['name'] == pluginSpec.name:
                 raise KeyError("Cannot add plugin multiple times.")
+        inherited = self.inheritance.plugins(self.name).get(pluginSpec.name)
+        if inherited is not None and inherited.versionSpec == pluginSpec.versionSpec:
+            raise KeyError("Plugin {} is already inherited.".format(inherited))
+        self.inheritance.invalidate()
         self.config['plugins'].append({'name': pluginSpec.name, 'version': str(pluginSpec.versionSpec)})
 
-    def pluginStates(self, repos):
-        managedPluginFilenames = []
+    def pluginStates(self, repos, preferLocal=True, restrictLocal=False):
+        catalog = repos if isinstance(repos, Catalog) else Catalog(repos)
+        localVersions = {}
+        if preferLocal:
+            localVersions = scanVersions(self.transport.snapshot(os.path.join(self.pluginPath, 'versions')))
+        pluginFiles = self.transport.snapshot(self.pluginPath)
+
+        managedPluginFilenames = set()
         for plugin in self.plugins():
-            compatibleVersions = []
             pluginLinkName = '{}.jar'.format(plugin.name)
-            managedPluginFilenames.append(pluginLinkName)
+            managedPluginFilenames.add(pluginLinkName)
 
-            if os.path.exists(os.path.join(self.pluginPath, pluginLinkName)) and not os.path.islink(os.path.join(self.pluginPath, pluginLinkName)):
+            linkEntry = pluginFiles.get(pluginLinkName)
+            if linkEntry is not None and not linkEntry.isSymlink():
                 yield SymlinkConflict(plugin)
                 continue
 
-            for installedVersion in self.versionsForPlugin(plugin.name, repos):
-                if installedVersion in plugin.versionSpec:
-                    compatibleVersions.append(installedVersion)
+            installedVersions = localVersions.get(plugin.name)
+            if installedVersions is not None and restrictLocal:
+                # Only local jars the catalog could have installed count.
+                installedVersions = SortedVersions([v for v in installedVersions if catalog.hasVersion(plugin.name, v)])
+            preferredVersion = None if installedVersions is None else installedVersions.newest(plugin)
 
-            if len(compatibleVersions) == 0:
-                for repo in repos:
-                    for repoPlugin in repo.plugins():
-                        if repoPlugin.name == plugin.name and repoPlugin.version in plugin.versionSpec:
-                            compatibleVersions.append(repoPlugin)
-                if len(compatibleVersions) == 0:
+            if preferredVersion is None:
+                repoPlugin = catalog.bestMatch(plugin)
+                if repoPlugin is None:
                     yield MissingVersions(plugin)
                 else:
-                    preferredVersion = list(reversed(sorted(compatibleVersions)))[0]
-                    yield Available(preferredVersion)
+                    yield Available(repoPlugin)
             else:
-                preferredVersion = list(reversed(sorted(compatibleVersions)))[0]
                 currentVersion = self.currentVersionForPlugin(plugin.name)
 
                 if currentVersion == preferredVersion:
@@ -51,46 +92,161 @@ class Server:
                 else:
                     yield OutdatedSymlink(plugin, currentVersion, preferredVersion)
 
-        otherPlugins = os.listdir(self.pluginPath)
-        for pluginFile in otherPlugins:
-            if os.path.isfile(os.path.join(self.pluginPath, pluginFile)) and pluginFile not in managedPluginFilenames:
-                yield UnmanagedFile(pluginFile)
+        for entry in pluginFiles:
+            if entry.name not in managedPluginFilenames and entry.isFile():
+                yield UnmanagedFile(entry.name)
 
     def currentVersionForPlugin(self, pluginName):
-        pluginSymlink = os.path.join(self.pluginPath, pluginName + '.jar')
-        if not os.path.lexists(pluginSymlink):
+        pluginJar = self.resolveLink(pluginName)
+        if pluginJar is None:
+            return None
+        return parseJarVersion(pluginName, os.path.basename(pluginJar))
+
+    def resolveLink(self, pluginName):
+        target = self.transport.snapshot(self.pluginPath).target(pluginName + '.jar')
+        if target is None:
             return None
-        suffix = '.jar'
-        pluginJar = os.path.basename(os.readlink(pluginSymlink))
-        jarVersion = pluginJar[len(pluginName)+1:len(pluginJar)-len(suffix)]
+        path = os.path.normpath(os.path.join(self.pluginPath, target))
+        currentPath = os.path.join(self.generationsPath(), CURRENT_GENERATION)
+        if os.path.dirname(path) == currentPath:
+            # One readlink through current is cheaper than scanning the
+            # generation directories just to follow a single link.
+            try:
+                target = self.transport.readlink(path)
+            except OSError:
+                return None
+            path = os.path.normpath(os.path.join(currentPath, target))
+        return path
+
+    def generationsPath(self):
+        return os.path.join(self.pluginPath, GENERATIONS_DIRNAME)
+
+    def generations(self):
+        generations = self.transport.snapshot(self.generationsPath(), optional=True)
+        if generations is None:
+            return []
+        return sorted(int(name) for name in generations.names() if name.isdigit())
+
+    def currentGeneration(self):
+        generations = self.transport.snapshot(self.generationsPath(), optional=True)
         try:
-            pluginSemver = Version.coerce(jarVersion)
-        except ValueError:
-            pluginSemver = jarVersion
-        return pluginSemver
-
-    def versionsForPlugin(self, pluginName, repos):
-        plugins = os.listdir(os.path.join(self.pluginPath, 'versions'))
-        for pluginJar in plugins:
-            if pluginJar.startswith(pluginName):
-                prefix = pluginName + '-'
-                suffix = '.jar'
-                jarVersion = pluginJar[len(prefix):len(pluginJar)-len(suffix)]
-                try:
-                    pluginSemver = Version.coerce(jarVersion)
-                except ValueError:
-                    pluginSemver = jarVersion
-                yield pluginSemver
+            return int(generations.target(CURRENT_GENERATION))
+        except (AttributeError, TypeError, ValueError):
+            return None
 
-    def updateSymlinkForPlugin(self, plugin, version):
-        pluginFilename = os.path.join(self.pluginPath, 'versions/{}-{}.jar'.format(plugin.name, version))
-        pluginSymlink = os.path.join(self.pluginPath, plugin.name + '.jar')
-        linkDst = os.path.relpath(pluginFilename, self.pluginPath)
+    def generationLinks(self, generation):
+        links = {}
+        generationPath = os.path.join(self.generationsPath(), str(generation))
+        for entry in self.transport.snapshot(generationPath):
+            if entry.isSymlink() and entry.name.endswith('.jar'):
+                links[entry.name[:-len('.jar')]] = os.path.normpath(os.path.join(generationPath, entry.target()))
+        return links
+
+    def legacyLinks(self):
+        links = {}
+        versionsPath = os.path.join(self.pluginPath, 'versions')
+        for entry in self.transport.snapshot(self.pluginPath):
+            if entry.isSymlink() and entry.name.endswith('.jar'):
+                target = os.path.normpath(os.path.join(self.pluginPath, entry.target()))
+                if os.path.dirname(target) == versionsPath:
+                    links[entry.name[:-len('.jar')]] = target
+        return links
 
-        if os.path.lexists(pluginSymlink):
-            os.unlink(pluginSymlink)
-        os.symlink(linkDst, pluginSymlink)
+    def linkedJars(self):
+        current = self.currentGeneration()
+        if current is None:
+            return self.legacyLinks()
+        return self.generationLinks(current)
+
+    def referencedJars(self):
+        referenced = set(self.legacyLinks().values())
+        for generation in self.generations():
+            referenced.update(self.generationLinks(generation).values())
+        return referenced
+
+    def applyVersions(self, versions, keep=KEEP_GENERATIONS):
+        links = self.linkedJars()
+        for (name, version) in versions.items():
+            links[name] = os.path.join(self.pluginPath, 'versions', '{}-{}.jar'.format(name, version))
+
+        if len(self.generations()) == 0:
+            # Record the pre-existing direct links so the first switch can
+            # be rolled back as well.
+            legacy = self.legacyLinks()
+            if len(legacy) > 0:
+                self.writeGeneration(legacy)
+
+        generation = self.writeGeneration(links)
+        self.switchGeneration(generation)
+        self.pruneGenerations(keep)
+        self.transport.flush()
+        return generation
+
+    def writeGeneration(self, links):
+        generations = self.generations()
+        generation = generations[-1] + 1 if len(generations) > 0 else 1
+        generationPath = os.path.join(self.generationsPath(), str(generation))
+        self.transport.makedirs(generationPath)
+        for (name, target) in links.items():
+            self.transport.symlink(os.path.relpath(target, generationPath), os.path.join(generationPath, name + '.jar'))
+        self.transport.invalidate(self.generationsPath())
+        return generation
+
+    def switchGeneration(self, generation):
+        current = os.path.join(self.generationsPath(), CURRENT_GENERATION)
+        # The whole plugin set flips with this one rename.
+        self.transport.symlink(str(generation), current, replace=True)
+        self.transport.invalidate(self.generationsPath())
+        for name in self.generationLinks(generation):
+            self.ensurePluginLink(name)
+
+    def ensurePluginLink(self, name):
+        link = os.path.join(self.pluginPath, name + '.jar')
+        target = os.path.join(GENERATIONS_DIRNAME, CURRENT_GENERATION, name + '.jar')
+        try:
+            if self.transport.readlink(link) == target:
+                return
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # A regular file is a SymlinkConflict; leave it alone.
+            return
+        self.transport.symlink(target, link, replace=True)
+        self.transport.invalidate(self.pluginPath)
+
+    def pruneGenerations(self, keep):
+        current = self.currentGeneration()
+        generations = self.generations()
+        for generation in generations[:max(len(generations) - keep, 0)]:
+            if generation != current:
+                self.transport.rmtree(os.path.join(self.generationsPath(), str(generation)))
+                self.transport.invalidate(self.generationsPath(), os.path.join(self.generationsPath(), str(generation)))
+
+    def rollback(self, generation=None):
+        current = self.currentGeneration()
+        generations = self.generations()
+        if generation is None:
+            previous = [g for g in generations if current is not None and g < current]
+            if len(previous) == 0:
+                raise ValueError("No earlier generation to roll back to.")
+            generation = previous[-1]
+        elif generation not in generations:
+            raise ValueError("Unknown generation {}.".format(generation))
+        self.switchGeneration(generation)
+        self.transport.flush()
+        return generation
+
+    def versionsForPlugin(self, pluginName, repos=None):
+        return iter(scanVersions(self.transport.snapshot(os.path.join(self.pluginPath, 'versions'))).get(pluginName, ()))
+
+    def updateSymlinkForPlugin(self, plugin, version):
+        return self.applyVersions({plugin.name: version})
 
     def installVersion(self, plugin):
         dest = os.path.join(self.pluginPath, 'versions/{}-{}.jar'.format(plugin.name, plugin.version))
-        shutil.copyfile(plugin.path, dest)
+        # Install from the repo's blob store, never from the named repo file,
+        # so a jar edited on one server cannot reach the repo or other servers.
+        store = BlobStore(os.path.dirname(plugin.path))
+        method = self.transport.put(store.blobPath(store.add(plugin.path)), dest)
+        self.transport.invalidate(os.path.dirname(dest))
+        return method
@@ -0,0 +1,74 @@
+import os
+
+class Entry:
+    def __init__(self, dirEntry):
+        self.dirEntry = dirEntry
+        self.name = dirEntry.name
+        self.path = dirEntry.path
+        self.cachedTarget = None
+
+    # DirEntry answers these from the scandir result and caches any stat it
+    # has to make, so each is at most one syscall per entry per snapshot.
+    def isSymlink(self):
+        return self.dirEntry.is_symlink()
+
+    def isFile(self, followSymlinks=True):
+        return self.dirEntry.is_file(follow_symlinks=followSymlinks)
+
+    def isDir(self, followSymlinks=True):
+        return self.dirEntry.is_dir(follow_symlinks=followSymlinks)
+
+    def stat(self, followSymlinks=False):
+        return self.dirEntry.stat(follow_symlinks=followSymlinks)
+
+    def target(self):
+        if self.cachedTarget is None and self.isSymlink():
+            self.cachedTarget = os.readlink(self.path)
+        return self.cachedTarget
+
+class DirSnapshot:
+    def __init__(self, path, entries=None):
+        self.path = path
+        self.entries = entries
+        if entries is None:
+            self.entries = {}
+            with os.scandir(path) as it:
+                for dirEntry in it:
+                    self.entries[dirEntry.name] = Entry(dirEntry)
+
+    def __iter__(self):
+        return iter(self.entries.values())
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def get(self, name):
+        return self.entries.get(name)
+
+    def names(self):
+        return self.entries.keys()
+
+    def target(self, name):
+        entry = self.entries.get(name)
+        if entry is None:
+            return None
+        return entry.target()
+
+snapshots = {}
+
+def snapshot(path, optional=False):
+    path = os.path.normpath(path)
+    if path not in snapshots:
+        try:
+            snapshots[path] = DirSnapshot(path)
+        except (FileNotFoundError, NotADirectoryError):
+            if not optional:
+                raise
+            return None
+    return snapshots[path]
+
+def invalidate(*paths):
+    if len(paths) == 0:
+        snapshots.clear()
+    for path in paths:
+        snapshots.pop(os.path.normpath(path), None)
@@ -0,0 +1,75 @@
+import hashlib
+import os
+from mpm import throttle
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FICLONE = 0x40049409
+BLOB_DIRNAME = '.blobs'
+READ_ONLY = 0o444
+
+def hashFile(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def reflink(src, dest):
+    if fcntl is None:
+        raise OSError("Reflinks are not supported on this platform")
+    with open(src, 'rb') as srcFd, open(dest, 'wb') as destFd:
+        try:
+            fcntl.ioctl(destFd.fileno(), FICLONE, srcFd.fileno())
+        except OSError:
+            destFd.close()
+            os.unlink(dest)
+            raise
+
+def linkOrCopy(src, dest, hardlink=True, preferReflink=False):
+    tmp = dest + '.mpm-tmp'
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    methods = [('hardlink', os.link), ('reflink', reflink)]
+    if not hardlink:
+        methods = methods[1:]
+    elif preferReflink:
+        methods.reverse()
+    for (method, link) in methods:
+        try:
+            link(src, tmp)
+            break
+        except OSError:
+            pass
+    else:
+        throttle.copyFile(src, tmp)
+        method = 'copy'
+    # Hardlinked files share their inode with the blob, so nothing linked
+    # from the store may be written to in place.
+    os.chmod(tmp, READ_ONLY)
+    os.replace(tmp, dest)
+    return method
+
+class BlobStore:
+    def __init__(self, path):
+        self.path = os.path.join(path, BLOB_DIRNAME)
+
+    def blobPath(self, digest):
+        return os.path.join(self.path, digest[:2], digest)
+
+    def contains(self, digest):
+        return os.path.exists(self.blobPath(digest))
+
+    def add(self, path, digest=None):
+        if digest is None:
+            digest = hashFile(path)
+        blob = self.blobPath(digest)
+        if not os.path.exists(blob):
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            # Never hardlink foreign files into the store; they may be
+            # modified or truncated in place after the import.
+            linkOrCopy(path, blob, hardlink=False)
+        return digest
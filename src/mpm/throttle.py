@@ -0,0 +1,140 @@
+import contextlib
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from mpm import instrument
+
+CHUNK_SIZE = 1024 * 1024
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+size_pattern = re.compile(r'^(?P<amount>\d+(?:\.\d+)?)(?P<unit>[kmg]?)(?:i?b)?$', re.IGNORECASE)
+
+active = None
+
+def parseSize(value):
+    matches = size_pattern.match(value.strip())
+    if matches is None:
+        raise ValueError("Invalid size: {}".format(value))
+    return int(float(matches['amount']) * SIZE_UNITS[matches['unit'].lower()])
+
+def formatSize(amount):
+    for unit in ('B', 'KiB', 'MiB'):
+        if amount < 1024:
+            return "{:.1f} {}".format(amount, unit)
+        amount /= 1024
+    return "{:.1f} GiB".format(amount)
+
+class Budget:
+    def __init__(self, rate=None, concurrency=None):
+        self.rate = rate
+        self.slots = None if concurrency is None else threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+        self.next = time.monotonic()
+        self.bytes = 0
+        self.operations = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+
+    @contextlib.contextmanager
+    def slot(self):
+        if self.slots is not None:
+            self.slots.acquire()
+        start = time.monotonic()
+        with self.lock:
+            if self.started is None:
+                self.started = start
+        try:
+            yield
+        finally:
+            end = time.monotonic()
+            with self.lock:
+                self.operations += 1
+                self.busy += end - start
+                self.finished = end
+            if self.slots is not None:
+                self.slots.release()
+
+    def consume(self, amount):
+        with self.lock:
+            self.bytes += amount
+            if self.rate is None:
+                return
+            # Every chunk books the next free stretch of the shared rate, so
+            # parallel copies split the budget instead of each getting it.
+            now = time.monotonic()
+            self.next = max(self.next, now) + amount / self.rate
+            delay = self.next - now
+        if delay > 0:
+            time.sleep(delay)
+
+    def throughput(self):
+        if self.started is None or self.finished <= self.started:
+            return 0.0
+        return self.bytes / (self.finished - self.started)
+
+class Scheduler:
+    def __init__(self, rate=None, concurrency=None, perDevice=False):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.perDevice = perDevice
+        self.lock = threading.Lock()
+        self.budgets = {}
+
+    def budget(self, dest, device=None):
+        # Remote targets pass their own key (the transport command) since
+        # they have no local st_dev.
+        if not self.perDevice:
+            device = None
+        elif device is None:
+            device = os.stat(os.path.dirname(os.path.abspath(dest))).st_dev
+        with self.lock:
+            if device not in self.budgets:
+                self.budgets[device] = Budget(self.rate, self.concurrency)
+            return self.budgets[device]
+
+    def send(self, srcFd, destFd, budget):
+        copied = 0
+        with budget.slot():
+            for chunk in iter(lambda: srcFd.read(CHUNK_SIZE), b''):
+                budget.consume(len(chunk))
+                destFd.write(chunk)
+                copied += len(chunk)
+        if instrument.active is not None:
+            instrument.active.copied(copied)
+        return copied
+
+    def copy(self, src, dest):
+        budget = self.budget(dest)
+        with open(src, 'rb') as srcFd, open(dest, 'wb') as destFd:
+            self.send(srcFd, destFd, budget)
+        return dest
+
+    def printReport(self, stream=sys.stderr):
+        for (device, budget) in sorted(self.budgets.items(), key=lambda item: str(item[0])):
+            if device is None:
+                label = "all devices"
+            elif isinstance(device, str):
+                label = device
+            else:
+                label = "device {}:{}".format(os.major(device), os.minor(device))
+            print("I/O {}: {} in {} copies, {}/s".format(label, formatSize(budget.bytes), budget.operations, formatSize(budget.throughput())), file=stream)
+
+def enable(rate=None, concurrency=None, perDevice=False):
+    global active
+    active = Scheduler(rate, concurrency, perDevice)
+    return active
+
+def disable():
+    global active
+    scheduler = active
+    active = None
+    return scheduler
+
+def copyFile(src, dest):
+    if active is None:
+        return shutil.copyfile(src, dest)
+    return active.copy(src, dest)
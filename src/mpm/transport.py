@@ -0,0 +1,269 @@
+import errno
+import json
+import os
+import shlex
+import shutil
+import subprocess
+from mpm import instrument, snapshot, throttle
+from mpm.store import hashFile, linkOrCopy
+from mpm.throttle import CHUNK_SIZE
+
+MAX_SYMLINK_HOPS = 8
+BOOTSTRAP = 'import sys; exec(sys.stdin.buffer.read(int(sys.stdin.buffer.readline())))'
+
+class LocalTransport:
+    remote = False
+
+    def snapshot(self, path, optional=False):
+        return snapshot.snapshot(path, optional)
+
+    def invalidate(self, *paths):
+        snapshot.invalidate(*paths)
+
+    def mtime(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def readlink(self, path):
+        return os.readlink(path)
+
+    def makedirs(self, path):
+        os.makedirs(path)
+
+    def symlink(self, target, path, replace=False):
+        if not replace:
+            os.symlink(target, path)
+            return
+        tmp = path + '.mpm-tmp'
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        os.symlink(target, tmp)
+        os.replace(tmp, path)
+
+    def put(self, src, dest):
+        return linkOrCopy(src, dest, preferReflink=True)
+
+    def rmtree(self, path):
+        shutil.rmtree(path)
+
+    def unlink(self, path):
+        os.unlink(path)
+
+    def flush(self):
+        pass
+
+local = LocalTransport()
+
+class RemoteEntry:
+    def __init__(self, transport, path, kind, size, mtime, target):
+        self.transport = transport
+        self.name = os.path.basename(path)
+        self.path = path
+        self.kind = kind
+        self.st_size = size
+        self.st_mtime_ns = mtime
+        self.linkTarget = target
+
+    def isSymlink(self):
+        return self.kind == 'link'
+
+    def resolved(self, followSymlinks):
+        if followSymlinks and self.kind == 'link':
+            return self.transport.lookup(self.path, True)
+        return self
+
+    def isFile(self, followSymlinks=True):
+        entry = self.resolved(followSymlinks)
+        return entry is not None and entry.kind == 'file'
+
+    def isDir(self, followSymlinks=True):
+        entry = self.resolved(followSymlinks)
+        return entry is not None and entry.kind == 'dir'
+
+    def stat(self, followSymlinks=False):
+        entry = self.resolved(followSymlinks)
+        if entry is None:
+            raise FileNotFoundError(errno.ENOENT, "No such file", self.path)
+        return entry
+
+    def target(self):
+        return self.linkTarget
+
+class CommandTransport:
+    remote = True
+
+    def __init__(self, command, root):
+        self.command = shlex.split(command)
+        self.root = os.path.normpath(root)
+        self.tree = None
+        self.mtimes = {}
+        self.snapshots = {}
+        self.ops = []
+        self.uploads = []
+
+    def call(self, request, uploads=()):
+        with open(os.path.join(os.path.dirname(__file__), 'agent.py'), 'rb') as fd:
+            agent = fd.read()
+        argv = self.command + ['python3 -c {}'.format(shlex.quote(BOOTSTRAP))]
+        if instrument.active is not None:
+            instrument.active.count('transport')
+        process = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            process.stdin.write(b'%d\n' % len(agent) + agent)
+            process.stdin.write(json.dumps(request).encode() + b'\n')
+            scheduler = throttle.active
+            for (path, dest) in uploads:
+                with open(path, 'rb') as fd:
+                    if scheduler is None:
+                        shutil.copyfileobj(fd, process.stdin, CHUNK_SIZE)
+                    else:
+                        scheduler.send(fd, process.stdin, scheduler.budget(dest, ' '.join(self.command)))
+            process.stdin.close()
+        except BrokenPipeError:
+            # The agent gave up early; its response says why.
+            pass
+        output = process.stdout.read()
+        status = process.wait()
+        try:
+            response = json.loads(output)
+        except ValueError:
+            raise OSError("{} exited with status {}".format(' '.join(self.command), status))
+        if 'error' in response:
+            raise OSError(response['error'])
+        return response['result']
+
+    def load(self):
+        if self.tree is None:
+            # The whole plugin tree of the server arrives in one call; every
+            # read after that is answered locally until the next flush.
+            result = self.call({'op': 'list', 'root': self.root})
+            self.tree = {}
+            for (path, entries) in result['dirs'].items():
+                directory = self.tree[os.path.normpath(path)] = {}
+                for (name, kind, size, mtime, target) in entries:
+                    directory[name] = RemoteEntry(self, os.path.join(path, name), kind, size, mtime, target)
+            self.mtimes = {os.path.normpath(path): mtime for (path, mtime) in result['mtimes'].items()}
+        return self.tree
+
+    def lookup(self, path, followSymlinks=False, hops=0):
+        tree = self.load()
+        (parent, name) = os.path.split(os.path.normpath(path))
+        if parent not in tree and parent != self.root and hops < MAX_SYMLINK_HOPS:
+            entry = self.lookup(parent, True, hops + 1)
+            if entry is None or entry.kind != 'dir':
+                return None
+            parent = entry.path
+        entry = tree.get(parent, {}).get(name)
+        if entry is None:
+            if path in tree:
+                return RemoteEntry(self, path, 'dir', 0, self.mtimes.get(path), None)
+            return None
+        if followSymlinks and entry.kind == 'link' and hops < MAX_SYMLINK_HOPS:
+            return self.lookup(os.path.join(parent, entry.linkTarget), True, hops + 1)
+        return entry
+
+    def snapshot(self, path, optional=False):
+        path = os.path.normpath(path)
+        if path not in self.snapshots:
+            tree = self.load()
+            if path not in tree:
+                if optional:
+                    return None
+                raise FileNotFoundError(errno.ENOENT, "No such directory", path)
+            self.snapshots[path] = snapshot.DirSnapshot(path, dict(tree[path]))
+        return self.snapshots[path]
+
+    def invalidate(self, *paths):
+        if len(paths) == 0:
+            self.snapshots.clear()
+        for path in paths:
+            self.snapshots.pop(os.path.normpath(path), None)
+
+    def mtime(self, path):
+        self.load()
+        return self.mtimes.get(os.path.normpath(path))
+
+    def readlink(self, path):
+        entry = self.lookup(path)
+        if entry is None:
+            raise FileNotFoundError(errno.ENOENT, "No such file", path)
+        if entry.kind != 'link':
+            raise OSError(errno.EINVAL, "Not a symlink", path)
+        return entry.linkTarget
+
+    def record(self, path, kind, size=0, target=None):
+        tree = self.load()
+        (parent, name) = os.path.split(os.path.normpath(path))
+        tree.setdefault(parent, {})[name] = RemoteEntry(self, path, kind, size, None, target)
+        self.invalidate(parent)
+
+    def makedirs(self, path):
+        path = os.path.normpath(path)
+        self.ops.append(['makedirs', path])
+        self.load().setdefault(path, {})
+        self.record(path, 'dir')
+
+    def symlink(self, target, path, replace=False):
+        self.ops.append(['symlink', target, os.path.normpath(path), replace])
+        self.record(path, 'link', target=target)
+
+    def put(self, src, dest):
+        self.ops.append(['put', os.path.normpath(dest), src])
+        self.record(dest, 'file', os.path.getsize(src))
+        return 'upload'
+
+    def rmtree(self, path):
+        path = os.path.normpath(path)
+        self.ops.append(['rmtree', path])
+        tree = self.load()
+        for directory in [d for d in tree if d == path or d.startswith(path + os.sep)]:
+            del tree[directory]
+            self.invalidate(directory)
+        (parent, name) = os.path.split(path)
+        tree.get(parent, {}).pop(name, None)
+        self.invalidate(parent)
+
+    def unlink(self, path):
+        path = os.path.normpath(path)
+        self.ops.append(['unlink', path])
+        (parent, name) = os.path.split(path)
+        self.load().get(parent, {}).pop(name, None)
+        self.invalidate(parent)
+
+    def flush(self):
+        if len(self.ops) == 0:
+            return
+        (ops, self.ops) = (self.ops, [])
+        puts = {op[2]: (hashFile(op[2]), os.path.getsize(op[2])) for op in ops if op[0] == 'put'}
+        found = {}
+        if len(puts) > 0:
+            found = self.call({'op': 'have', 'root': self.root, 'wanted': list(set(puts.values()))})
+        requests = []
+        uploads = []
+        for op in ops:
+            if op[0] == 'put':
+                (dest, src) = op[1:]
+                (digest, size) = puts[src]
+                if digest in found:
+                    if found[digest] != dest:
+                        requests.append(['copy', found[digest], dest])
+                    continue
+                requests.append(['put', dest, size, digest])
+                uploads.append((src, dest))
+            else:
+                requests.append(op)
+        try:
+            self.call({'op': 'apply', 'ops': requests}, uploads)
+        finally:
+            # Re-list on the next read rather than trusting the local model
+            # of a tree that may have been partially updated.
+            self.tree = None
+            self.snapshots.clear()
+
+def openTransport(config):
+    command = config.get('transport')
+    if command is None:
+        return local
+    return CommandTransport(command, config['path'])
@@ -0,0 +1,76 @@
+import json
+import os
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from mpm.store import hashFile
+
+def defaultCachePath():
+    cacheHome = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(cacheHome, 'mpm', 'hashes.json')
+
+def statKey(path):
+    st = os.stat(path)
+    return [st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns]
+
+class HashCache:
+    def __init__(self, path=None):
+        self.path = path or defaultCachePath()
+        self.entries = {}
+        self.dirty = False
+        try:
+            with open(self.path, 'r') as fd:
+                self.entries = json.load(fd)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, path):
+        entry = self.entries.get(os.path.abspath(path))
+        if entry is not None and entry['stat'] == statKey(path):
+            return (entry['digest'], entry['error'])
+        return None
+
+    def put(self, path, digest, error):
+        self.entries[os.path.abspath(path)] = {'stat': statKey(path), 'digest': digest, 'error': error}
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as fd:
+                json.dump(self.entries, fd)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+def verifyJar(path):
+    digest = hashFile(path)
+    try:
+        with zipfile.ZipFile(path) as archive:
+            badMember = archive.testzip()
+        if badMember is not None:
+            return (digest, "CRC mismatch in {}".format(badMember))
+    except (zipfile.BadZipFile, zlib.error, EOFError) as e:
+        return (digest, "Not a valid zip archive: {}".format(e))
+    return (digest, None)
+
+def verifyJars(paths, cache, jobs=None):
+    results = {}
+    pending = []
+    for path in paths:
+        cached = cache.get(path)
+        if cached is None:
+            pending.append(path)
+        else:
+            results[path] = cached
+
+    if len(pending) > 0:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for (path, result) in zip(pending, pool.map(verifyJar, pending)):
+                cache.put(path, *result)
+                results[path] = result
+    cache.save()
+    return results
@@ -0,0 +1,192 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from mpm.model import *
+from mpm import snapshot
+from mpm.plan import applyActions, buildPlan
+from mpm.resolver import ServerResolution
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_FORMAT = 'iIII'
+EVENT_SIZE = struct.calcsize(EVENT_FORMAT)
+
+class Inotify:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.addWatch = libc.inotify_add_watch
+        self.addWatch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths = {}
+
+    def watch(self, path):
+        wd = self.addWatch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "Cannot watch {}".format(path))
+        self.paths[wd] = path
+
+    def read(self, timeout):
+        (ready, _, _) = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        events = []
+        data = os.read(self.fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            (wd, mask, cookie, length) = struct.unpack_from(EVENT_FORMAT, data, offset)
+            name = data[offset + EVENT_SIZE:offset + EVENT_SIZE + length].rstrip(b'\0')
+            offset += EVENT_SIZE + length
+            if wd in self.paths:
+                events.append((self.paths[wd], os.fsdecode(name)))
+        return events
+
+class Poller:
+    def __init__(self):
+        self.mtimes = {}
+
+    def watch(self, path):
+        self.mtimes[path] = os.stat(path).st_mtime_ns
+
+    def read(self, timeout):
+        time.sleep(timeout)
+        events = []
+        for (path, mtime) in self.mtimes.items():
+            try:
+                current = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            if current != mtime:
+                self.mtimes[path] = current
+                events.append((path, None))
+        return events
+
+def openWatcher():
+    try:
+        return Inotify()
+    except (OSError, AttributeError, TypeError):
+        return Poller()
+
+class Watcher:
+    def __init__(self, config, apply=False, log=print):
+        self.config = config
+        self.apply = apply
+        self.log = log
+        self.catalog = config.catalog()
+        # Remote servers have no local directories to watch, and their cached
+        # remote tree would only go stale, so watch leaves them alone.
+        self.servers = {server.name: server for server in config.servers() if not server.transport.remote}
+        self.resolutions = {}
+        self.plans = {}
+        self.owners = {}
+        self.events = openWatcher()
+
+    def start(self):
+        for repo in self.catalog.repos:
+            self.watchPath(repo.path, ('repo', repo.name))
+        for server in self.servers.values():
+            self.watchPath(server.pluginPath, ('server', server.name))
+            self.watchPath(os.path.join(server.pluginPath, 'versions'), ('server', server.name))
+            self.watchGenerations(server)
+        self.reconcile(self.servers)
+
+    def watchGenerations(self, server):
+        # The first apply creates .generations, so it is picked up then;
+        # otherwise a rollback from another shell would go unnoticed.
+        path = server.generationsPath()
+        if path not in self.owners and os.path.isdir(path):
+            self.watchPath(path, ('server', server.name))
+
+    def watchPath(self, path, owner):
+        try:
+            self.events.watch(path)
+        except OSError as e:
+            self.log("Cannot watch {}: {}".format(path, e))
+            return
+        self.owners[path] = owner
+
+    def serversUsing(self, pluginName):
+        if pluginName is None:
+            return set(self.servers)
+        return {name for (name, server) in self.servers.items() if pluginName in {spec.name for spec in server.plugins()}}
+
+    def affectedServers(self, events):
+        affected = set()
+        for (path, filename) in events:
+            snapshot.invalidate(path)
+            (kind, name) = self.owners.get(path, (None, None))
+            if kind == 'server':
+                affected.add(name)
+            elif kind == 'repo':
+                if filename is not None and filename.startswith('.'):
+                    continue
+                self.catalog.invalidate()
+                pluginName = None
+                if filename is not None:
+                    matches = version_pattern.match(filename)
+                    pluginName = matches['name'] if matches is not None else None
+                affected |= self.serversUsing(pluginName)
+        return affected
+
+    def reconcile(self, names):
+        resolutions = []
+        for name in sorted(names):
+            server = self.servers[name]
+            try:
+                resolution = ServerResolution(server, list(server.pluginStates(self.catalog)))
+            except OSError as e:
+                self.log("{}: cannot resolve: {}".format(name, e))
+                continue
+            self.resolutions[name] = resolution
+            resolutions.append(resolution)
+
+        plan = buildPlan(resolutions)
+        for resolution in resolutions:
+            name = resolution.server.name
+            actions = plan.get(name)
+            if self.plans.get(name) == actions:
+                continue
+            self.plans[name] = actions
+            if actions is None:
+                self.log("{}: up to date".format(name))
+                continue
+            for action in actions:
+                self.log("{}: {} {} {}".format(name, action['action'], action['name'], action['version']))
+            if self.apply:
+                result = applyActions(resolution.server, actions)
+                self.watchGenerations(resolution.server)
+                if result.error is None:
+                    self.log("{}: applied {} changes".format(name, len(result.applied)))
+                else:
+                    self.log("{}: failed after {} changes: {}".format(name, len(result.applied), result.error))
+                    # Forget the plan so the next event for this server retries it.
+                    del self.plans[name]
+        return plan
+
+    def run(self, settle=0.2):
+        self.start()
+        while True:
+            events = self.events.read(None if isinstance(self.events, Inotify) else settle)
+            if len(events) == 0:
+                continue
+            # Collect the rest of a burst (e.g. a copy followed by a rename)
+            # before re-resolving.
+            while True:
+                more = self.events.read(settle)
+                if len(more) == 0:
+                    break
+                events += more
+            affected = self.affectedServers(events)
+            if len(affected) > 0:
+                self.reconcile(affected)
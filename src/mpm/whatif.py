@@ -0,0 +1,115 @@
+import os
+from mpm.model import *
+from mpm.repo import Repo
+from mpm.resolver import Catalog
+from mpm.server import Server
+
+def parseOverride(text):
+    (target, sep, spec) = text.partition('=')
+    if sep == '' or target == '':
+        raise ValueError("Expected PLUGIN=SPEC or SERVER:PLUGIN=SPEC, got '{}'".format(text))
+    (server, colon, plugin) = target.rpartition(':')
+    return ((server if colon else None, plugin), PluginSpec(plugin, spec))
+
+class Scenario:
+    def __init__(self, name, overrides=None, repos=None):
+        self.name = name
+        self.overrides = overrides or {}
+        self.repos = repos
+
+class ScenarioInheritance:
+    def __init__(self, base, overrides):
+        self.base = base
+        # Network-wide overrides first so a server-specific one wins.
+        self.overrides = sorted(overrides.items(), key=lambda item: item[0][0] is not None)
+
+    def invalidate(self):
+        self.base.invalidate()
+
+    def plugins(self, name):
+        specs = self.base.plugins(name)
+        changed = None
+        for ((server, plugin), spec) in self.overrides:
+            if server == name or (server is None and plugin in specs):
+                if changed is None:
+                    changed = dict(specs)
+                changed[plugin] = spec
+        return specs if changed is None else changed
+
+def stateTarget(state):
+    if isinstance(state, Installed):
+        return state.currentVersion
+    if isinstance(state, OutdatedSymlink):
+        return state.wantedVersion
+    if isinstance(state, Available):
+        return state.plugin.version
+    return None
+
+class WhatIf:
+    def __init__(self, servers, inheritance, repos):
+        self.servers = servers
+        self.inheritance = inheritance
+        self.repos = {repo.name: repo for repo in repos}
+        self.configured = {repo.path for repo in repos}
+        self.catalogs = {}
+        self.current = {}
+
+    def repository(self, nameOrPath):
+        if nameOrPath in self.repos:
+            return self.repos[nameOrPath]
+        if os.path.isdir(nameOrPath):
+            repo = Repo(nameOrPath, {'path': nameOrPath})
+            self.repos[nameOrPath] = repo
+            return repo
+        raise KeyError("Unknown repository {}".format(nameOrPath))
+
+    def catalog(self, repos):
+        # Scenarios that share a repo set share its catalog, so each set of
+        # jars is only loaded and sorted once per run.
+        key = tuple(sorted({repo.path for repo in repos}))
+        if key not in self.catalogs:
+            self.catalogs[key] = Catalog(repos)
+        return self.catalogs[key]
+
+    def currentVersion(self, server, pluginName):
+        key = (server.name, pluginName)
+        if key not in self.current:
+            self.current[key] = server.currentVersionForPlugin(pluginName)
+        return self.current[key]
+
+    def evaluate(self, scenario):
+        names = {server.name for server in self.servers}
+        for (server, plugin) in scenario.overrides:
+            if server is not None and server not in names:
+                raise KeyError("Unknown server {}".format(server))
+
+        repos = list(self.repos.values()) if scenario.repos is None else scenario.repos
+        catalog = self.catalog(repos)
+        inheritance = ScenarioInheritance(self.inheritance, scenario.overrides)
+        # Like sync, keep local jars that satisfy the spec, but a scenario
+        # that narrows the repos only keeps those its repos still carry.
+        restrict = scenario.repos is not None and {repo.path for repo in repos} != self.configured
+        outcomes = []
+        for server in self.servers:
+            # Sharing the transport lets every scenario reuse one listing of
+            # a remote server.
+            scenarioServer = Server(server.name, server.config, inheritance, server.transport)
+            changes = []
+            unsatisfiable = []
+            states = scenarioServer.pluginStates(catalog, restrictLocal=restrict)
+            for state in sorted(s for s in states if not isinstance(s, (UnmanagedFile, SymlinkConflict))):
+                spec = state.plugin.versionSpec if isinstance(state.plugin, PluginSpec) else inheritance.plugins(server.name)[state.plugin.name].versionSpec
+                if isinstance(state, MissingVersions):
+                    unsatisfiable.append({'plugin': state.plugin.name, 'spec': str(spec)})
+                    continue
+                current = self.currentVersion(server, state.plugin.name)
+                target = stateTarget(state)
+                if str(current) != str(target):
+                    changes.append({
+                        'plugin': state.plugin.name,
+                        'spec': str(spec),
+                        'current': None if current is None else str(current),
+                        'target': str(target),
+                    })
+            outcomes.append({'server': server.name, 'changes': changes, 'unsatisfiable': unsatisfiable})
+        return outcomes
@@ -0,0 +1,52 @@
+import zipfile
+import pytest
+from mpm.jar import readMember, readPluginMetadata
+
+def makeJar(path, members, compression=zipfile.ZIP_DEFLATED, comment=b''):
+    with zipfile.ZipFile(path, 'w', compression) as archive:
+        for (name, data) in members:
+            archive.writestr(name, data)
+        archive.comment = comment
+    return path
+
+@pytest.mark.parametrize('compression', (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED))
+def testReadMemberFindsEntryAfterOthers(tmp_path, compression):
+    payload = b'name: Foo\nversion: 1.2.3\n'
+    path = makeJar(tmp_path / 'foo.jar', [('a/B.class', b'x' * 5000), ('plugin.yml', payload), ('z.txt', b'z')], compression)
+    with open(path, 'rb') as fd:
+        assert readMember(fd, ('plugin.yml',)) == payload
+
+def testReadMemberSkipsArchiveComment(tmp_path):
+    path = makeJar(tmp_path / 'foo.jar', [('plugin.yml', b'name: Foo\n')], comment=b'PK\x05\x06 is not a record here' * 100)
+    with open(path, 'rb') as fd:
+        assert readMember(fd, ('plugin.yml',)) == b'name: Foo\n'
+
+def testReadMemberPrefersFirstListedName(tmp_path):
+    path = makeJar(tmp_path / 'foo.jar', [('paper-plugin.yml', b'paper'), ('plugin.yml', b'bukkit')])
+    with open(path, 'rb') as fd:
+        assert readMember(fd, ('plugin.yml', 'paper-plugin.yml')) == b'bukkit'
+
+def testReadMemberMissing(tmp_path):
+    path = makeJar(tmp_path / 'foo.jar', [('a.txt', b'a')])
+    with open(path, 'rb') as fd:
+        assert readMember(fd, ('plugin.yml',)) is None
+
+def testReadMemberRejectsNonZip(tmp_path):
+    path = tmp_path / 'foo.jar'
+    path.write_bytes(b'not a zip at all')
+    with open(path, 'rb') as fd, pytest.raises(ValueError):
+        readMember(fd, ('plugin.yml',))
+
+def testPluginMetadata(tmp_path):
+    path = makeJar(tmp_path / 'odd-name.jar', [('paper-plugin.yml', 'name: "Foo"\nversion: \'2.4.1-SNAPSHOT\'\nmain: a.B\n')])
+    metadata = readPluginMetadata(str(path))
+    assert (metadata['name'], metadata['version']) == ('Foo', '2.4.1')
+
+def testPluginMetadataWithoutVersion(tmp_path):
+    path = makeJar(tmp_path / 'foo.jar', [('plugin.yml', 'name: Foo\nmain: a.B\n')])
+    assert readPluginMetadata(str(path)) is None
+
+def testPluginMetadataOfCorruptJar(tmp_path):
+    path = tmp_path / 'foo.jar'
+    path.write_bytes(b'PK\x05\x06' + b'\xff' * 18)
+    assert readPluginMetadata(str(path)) is None
@@ -0,0 +1,56 @@
+import random
+import pytest
+from semantic_version import Version
+from mpm.matching import SortedVersions, compileSpec, packVersion
+from mpm.model import PluginSpec
+
+OPERATORS = ('', '==', '!=', '<', '<=', '>', '>=', '^', '~')
+
+def randomVersion(rng, prereleases=False):
+    version = '{}.{}.{}'.format(rng.randint(0, 3), rng.randint(0, 3), rng.randint(0, 3))
+    if prereleases and rng.random() < 0.2:
+        version += '-{}.{}'.format(rng.choice(('alpha', 'beta', 'rc')), rng.randint(1, 2))
+    return Version(version)
+
+def randomSpec(rng):
+    if rng.random() < 0.1:
+        return '*'
+    clauses = [rng.choice(OPERATORS) + str(randomVersion(rng)) for i in range(rng.randint(1, 3))]
+    return ','.join(clauses)
+
+def randomSpecs(rng, count):
+    specs = []
+    while len(specs) < count:
+        try:
+            specs.append(PluginSpec('Plugin', randomSpec(rng)))
+        except ValueError:
+            pass
+    return specs
+
+def contains(intervals, packed):
+    return any(lo <= packed <= hi for (lo, hi) in intervals)
+
+def testCompiledSpecsMatchSemanticVersion():
+    rng = random.Random(1)
+    releases = [Version('{}.{}.{}'.format(major, minor, patch)) for major in range(5) for minor in range(5) for patch in range(5)]
+    for spec in randomSpecs(rng, 500):
+        intervals = compileSpec(spec.versionSpec)
+        assert intervals is not None, str(spec)
+        for version in releases:
+            assert contains(intervals, packVersion(version)) == (version in spec.versionSpec), (str(spec), str(version))
+
+@pytest.mark.parametrize('prereleases', (False, True))
+def testNewestMatchesLinearScan(prereleases):
+    rng = random.Random(2)
+    for i in range(200):
+        versions = list({randomVersion(rng, prereleases) for j in range(rng.randint(0, 15))})
+        rng.shuffle(versions)
+        sortedVersions = SortedVersions(versions)
+        for spec in randomSpecs(rng, 10):
+            matching = [version for version in versions if version in spec.versionSpec]
+            assert sortedVersions.newest(spec) == (max(matching) if matching else None), (str(spec), [str(v) for v in versions])
+
+def testItemsAreSorted():
+    rng = random.Random(3)
+    versions = [randomVersion(rng, True) for i in range(100)]
+    assert list(SortedVersions(versions)) == sorted(versions)
@@ -0,0 +1,102 @@
+import hashlib
+import os
+import stat
+import pytest
+from mpm.transport import CommandTransport
+
+# `sh -c` runs the agent on this machine, which makes the server directory a
+# local stand-in for a remote host.
+STAND_IN = 'sh -c'
+
+@pytest.fixture
+def server(tmp_path):
+    root = tmp_path / 'server'
+    versions = root / 'plugins' / 'versions'
+    versions.mkdir(parents=True)
+    (versions / 'Foo-1.0.0.jar').write_bytes(b'foo 1.0.0')
+    os.symlink('versions/Foo-1.0.0.jar', str(root / 'plugins' / 'Foo.jar'))
+    return root
+
+@pytest.fixture
+def transport(server):
+    return CommandTransport(STAND_IN, str(server))
+
+def writeJar(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+def testListing(server, transport):
+    plugins = str(server / 'plugins')
+    listing = transport.snapshot(plugins)
+    assert sorted(listing.names()) == ['Foo.jar', 'versions']
+    assert transport.readlink(os.path.join(plugins, 'Foo.jar')) == 'versions/Foo-1.0.0.jar'
+    assert transport.lookup(os.path.join(plugins, 'Foo.jar'), followSymlinks=True).st_size == len(b'foo 1.0.0')
+    assert transport.mtime(plugins) == os.stat(plugins).st_mtime_ns
+    assert transport.snapshot(str(server / 'plugins' / '.generations'), optional=True) is None
+
+def testHave(server, transport):
+    data = b'foo 1.0.0'
+    digest = hashlib.sha256(data).hexdigest()
+    found = transport.call({'op': 'have', 'root': str(server), 'wanted': [[digest, len(data)], ['0' * 64, 3]]})
+    assert found == {digest: str(server / 'plugins' / 'versions' / 'Foo-1.0.0.jar')}
+
+def testUploadAndApply(tmp_path, server, transport):
+    versions = server / 'plugins' / 'versions'
+    src = writeJar(tmp_path / 'Bar-2.0.0.jar', b'bar 2.0.0' * 100000)
+    transport.put(src, str(versions / 'Bar-2.0.0.jar'))
+    transport.symlink('versions/Bar-2.0.0.jar', str(server / 'plugins' / 'Bar.jar'))
+    transport.symlink('versions/Bar-2.0.0.jar', str(server / 'plugins' / 'Foo.jar'), replace=True)
+    transport.flush()
+
+    assert (versions / 'Bar-2.0.0.jar').read_bytes() == b'bar 2.0.0' * 100000
+    assert stat.S_IMODE(os.stat(str(versions / 'Bar-2.0.0.jar')).st_mode) == 0o444
+    assert os.readlink(str(server / 'plugins' / 'Bar.jar')) == 'versions/Bar-2.0.0.jar'
+    assert os.readlink(str(server / 'plugins' / 'Foo.jar')) == 'versions/Bar-2.0.0.jar'
+    assert not os.path.lexists(str(server / 'plugins' / 'Foo.jar.mpm-tmp'))
+    # The tree is listed again after a flush.
+    assert 'Bar-2.0.0.jar' in transport.snapshot(str(versions)).names()
+
+def testContentAlreadyOnServerIsCopiedThere(tmp_path, server, transport, monkeypatch):
+    versions = server / 'plugins' / 'versions'
+    src = writeJar(tmp_path / 'Foo-1.0.0.jar', b'foo 1.0.0')
+    calls = []
+    call = transport.call
+    monkeypatch.setattr(transport, 'call', lambda request, uploads=(): calls.append((request['op'], list(uploads))) or call(request, uploads))
+    transport.put(src, str(versions / 'Foo-1.0.1.jar'))
+    transport.flush()
+
+    assert [(op, uploads) for (op, uploads) in calls if op == 'apply'] == [('apply', [])]
+    assert os.path.samefile(str(versions / 'Foo-1.0.1.jar'), str(versions / 'Foo-1.0.0.jar'))
+
+def testUploadWithWrongHashIsRejected(tmp_path, server, transport):
+    dest = str(server / 'plugins' / 'versions' / 'Bar-1.0.0.jar')
+    src = writeJar(tmp_path / 'Bar-1.0.0.jar', b'bar')
+    with pytest.raises(OSError, match='does not match its hash'):
+        transport.call({'op': 'apply', 'ops': [['put', dest, 3, '0' * 64]]}, [(src, dest)])
+    assert not os.path.exists(dest)
+
+def testTruncatedUploadIsRejected(tmp_path, server, transport):
+    dest = str(server / 'plugins' / 'versions' / 'Bar-1.0.0.jar')
+    src = writeJar(tmp_path / 'Bar-1.0.0.jar', b'bar')
+    with pytest.raises(OSError, match='Transfer ended early'):
+        transport.call({'op': 'apply', 'ops': [['put', dest, 10, hashlib.sha256(b'bar').hexdigest()]]}, [(src, dest)])
+    assert not os.path.exists(dest)
+
+def testRemoveAndUnlink(server, transport):
+    generation = str(server / 'plugins' / '.generations' / '1')
+    transport.makedirs(generation)
+    transport.symlink('../../versions/Foo-1.0.0.jar', os.path.join(generation, 'Foo.jar'))
+    transport.flush()
+    assert os.path.islink(os.path.join(generation, 'Foo.jar'))
+
+    transport.rmtree(generation)
+    transport.unlink(str(server / 'plugins' / 'Foo.jar'))
+    transport.flush()
+    assert not os.path.exists(generation)
+    assert not os.path.lexists(str(server / 'plugins' / 'Foo.jar'))
+
+def testErrorsAreReported(server, transport):
+    with pytest.raises(OSError, match='Unknown request'):
+        transport.call({'op': 'nope'})
+    with pytest.raises(OSError, match='FileNotFoundError'):
+        transport.call({'op': 'apply', 'ops': [['unlink', str(server / 'missing.jar')]]})